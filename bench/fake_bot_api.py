@@ -0,0 +1,238 @@
+"""Minimal in-memory stand-in for the Telegram Bot API.
+
+Сервер отвечает на методы, которые использует бот (sendMessage, editMessageText,
+sendVideo, getFile, deleteMessage, ...), хранит отправленные сообщения по чатам
+и отдаёт содержимое файлов по /file/bot<token>/<path>. Работает в отдельном
+потоке, чтобы не делить event loop с ботом.
+
+С local_mode=True ведёт себя как telegram-bot-api --local: getFile возвращает
+абсолютный путь на диске, а видео принимаются как file:// URI.
+"""
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+BOT_USER = {
+    'id': 1000000,
+    'is_bot': True,
+    'first_name': 'BenchBot',
+    'username': 'bench_bot',
+}
+
+
+class FakeBotAPI:
+    """Fake Bot API state: chats, message ids, uploaded files and call counters."""
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, local_mode=False):
+        self.latency = latency
+        self.local_mode = local_mode
+        self.local_dir = tempfile.mkdtemp(prefix="fake_bot_api_") if local_mode else None
+        self.files = {}
+        self.calls = Counter()
+        self.uploaded_bytes = 0
+        self.local_sends = 0
+        self._messages = {}
+        self._next_message_id = {}
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def port(self):
+        return self._server.server_address[1]
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.port}/bot"
+
+    @property
+    def base_file_url(self):
+        return f"http://127.0.0.1:{self.port}/file/bot"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-bot-api", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def add_file(self, file_id, path, data):
+        """Register a file that getFile/download will serve."""
+        if self.local_mode:
+            # Как у настоящего сервера: файл лежит на диске, отдаём абсолютный путь
+            local_path = os.path.join(self.local_dir, path)
+            os.makedirs(os.path.dirname(local_path), exist_ok=True)
+            with open(local_path, 'wb') as f:
+                f.write(data)
+            path = local_path
+        self.files[file_id] = (path, data)
+
+    def new_message_id(self, chat_id):
+        """Reserve a message id in a chat (used for incoming user messages too)."""
+        with self._lock:
+            message_id = self._next_message_id.get(chat_id, 0) + 1
+            self._next_message_id[chat_id] = message_id
+            self._messages.setdefault(chat_id, set()).add(message_id)
+            return message_id
+
+    def _message(self, chat_id, **extra):
+        message = {
+            'message_id': self.new_message_id(chat_id),
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': BOT_USER,
+        }
+        message.update(extra)
+        return message
+
+    def _delete(self, chat_id, message_id):
+        with self._lock:
+            messages = self._messages.get(chat_id, set())
+            if message_id in messages:
+                messages.discard(message_id)
+                return True
+            return False
+
+    def handle(self, method, params, body_size):
+        """Dispatch one Bot API method; returns (ok, result_or_description)."""
+        self.calls[method] += 1
+        chat_id = int(params['chat_id']) if params.get('chat_id') else None
+
+        if method == 'getMe':
+            return True, BOT_USER
+        if method in ('deleteWebhook', 'setMyCommands', 'answerCallbackQuery', 'close', 'logOut'):
+            return True, True
+        if method == 'getUpdates':
+            return True, []
+        if method == 'sendMessage':
+            return True, self._message(chat_id, text=params.get('text', ''))
+        if method == 'editMessageText':
+            return True, {
+                'message_id': int(params.get('message_id') or 0),
+                'date': int(time.time()),
+                'chat': {'id': chat_id or 0, 'type': 'private'},
+                'from': BOT_USER,
+                'text': params.get('text', ''),
+            }
+        if method == 'sendVideo':
+            video = params.get('video', '')
+            if video.startswith('file://'):
+                if not self.local_mode:
+                    return False, "Bad Request: file:// URIs require --local mode"
+                if not os.path.exists(urlparse(video).path):
+                    return False, "Bad Request: file not found"
+                self.local_sends += 1
+            else:
+                self.uploaded_bytes += body_size
+            return True, self._message(chat_id, video={
+                'file_id': f"sent{self.calls[method]}",
+                'file_unique_id': f"sentu{self.calls[method]}",
+                'width': 320, 'height': 240, 'duration': 1,
+            })
+        if method == 'sendPhoto':
+            self.uploaded_bytes += body_size
+            return True, self._message(chat_id, photo=[{
+                'file_id': f"photo{self.calls[method]}",
+                'file_unique_id': f"photou{self.calls[method]}",
+                'width': 960, 'height': 540,
+            }])
+        if method == 'sendDocument':
+            self.uploaded_bytes += body_size
+            return True, self._message(chat_id, document={
+                'file_id': f"doc{self.calls[method]}",
+                'file_unique_id': f"docu{self.calls[method]}",
+            })
+        if method == 'deleteMessage':
+            if self._delete(chat_id, int(params['message_id'])):
+                return True, True
+            return False, "Bad Request: message to delete not found"
+        if method == 'getFile':
+            file_id = params.get('file_id')
+            if file_id not in self.files:
+                return False, "Bad Request: invalid file_id"
+            path, data = self.files[file_id]
+            return True, {
+                'file_id': file_id,
+                'file_unique_id': file_id,
+                'file_size': len(data),
+                'file_path': path,
+            }
+        return False, f"Not Found: method {method} is not emulated"
+
+    def _make_handler(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Иначе заголовки и тело уходят разными пакетами и ждут delayed ACK
+            disable_nagle_algorithm = True
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send(self, status, payload, content_type='application/json'):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_GET(self):
+                path = urlparse(self.path).path
+                match = re.match(r'^/file/bot[^/]+/(.+)$', path)
+                if match:
+                    for file_path, data in api.files.values():
+                        if file_path == match.group(1):
+                            self._send(200, data, 'application/octet-stream')
+                            return
+                    self._send(404, b'')
+                    return
+                self._dispatch(path, {}, 0)
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length)
+                content_type = self.headers.get('Content-Type', '')
+                if content_type.startswith('application/json'):
+                    params = {k: str(v) for k, v in json.loads(body or b'{}').items()}
+                elif content_type.startswith('multipart/form-data'):
+                    params = _parse_multipart_fields(body)
+                else:
+                    params = {k: v[0] for k, v in parse_qs(body.decode()).items()}
+                self._dispatch(urlparse(self.path).path, params, length)
+
+            def _dispatch(self, path, params, body_size):
+                match = re.match(r'^/bot[^/]+/(\w+)$', path)
+                if not match:
+                    self._send(404, b'')
+                    return
+                if api.latency:
+                    time.sleep(api.latency)
+                ok, result = api.handle(match.group(1), params, body_size)
+                if ok:
+                    payload = {'ok': True, 'result': result}
+                    status = 200
+                else:
+                    payload = {'ok': False, 'error_code': 400, 'description': result}
+                    status = 400
+                self._send(status, json.dumps(payload).encode())
+
+        return Handler
+
+
+def _parse_multipart_fields(body):
+    """Extract plain (non-file) form fields from a multipart body."""
+    fields = {}
+    for match in re.finditer(rb'name="([^"]+)"\r\n(?:Content-Type: [^\r]*\r\n)?\r\n(.*?)\r\n--', body, re.S):
+        name, value = match.group(1).decode(), match.group(2)
+        if len(value) < 4096:
+            fields[name] = value.decode(errors='replace')
+    return fields
@@ -0,0 +1,351 @@
+"""Offline load test for the bot.
+
+Собирает Application из bot.build_application(), направляет его на фейковый
+Bot API сервер (bench/fake_bot_api.py) и прогоняет синтетические сценарии
+от N одновременных пользователей. Выводит пропускную способность, p50/p99
+задержки по шагам и потребление памяти.
+
+    python bench/run_bench.py --users 20 --rounds 5
+    python bench/run_bench.py --workload browse send_all --folder-size 50 --json result.json
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import defaultdict
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(BENCH_DIR), "src"))
+sys.path.insert(0, BENCH_DIR)
+
+import config  # noqa: E402
+import log_pipeline  # noqa: E402
+from fake_bot_api import FakeBotAPI, BOT_USER  # noqa: E402
+
+TOKEN = "123456:BENCH"
+BENCH_FOLDER = "bench"
+WORKLOADS = ("upload", "trim", "multi_trim", "browse", "send_all", "export", "clear")
+# Сценарии, которым нужно настоящее видео (ffmpeg)
+VIDEO_WORKLOADS = ("trim", "multi_trim")
+
+_update_ids = itertools.count(1)
+_callback_ids = itertools.count(1)
+
+
+def find_ffmpeg():
+    """ffmpeg from PATH or the binary bundled with imageio-ffmpeg (moviepy dependency)."""
+    ffmpeg = shutil.which("ffmpeg")
+    if ffmpeg:
+        return ffmpeg
+    try:
+        import imageio_ffmpeg
+        return imageio_ffmpeg.get_ffmpeg_exe()
+    except Exception:
+        return None
+
+
+def make_sample_video(path, seconds=2):
+    """Generate a small real mp4 with ffmpeg; returns False if ffmpeg is missing."""
+    ffmpeg = find_ffmpeg()
+    if not ffmpeg:
+        return False
+    subprocess.run(
+        [ffmpeg, "-loglevel", "error", "-y", "-f", "lavfi", "-i", f"testsrc=duration={seconds}:size=320x240:rate=25",
+         "-pix_fmt", "yuv420p", path],
+        check=True
+    )
+    return True
+
+
+class ErrorLogCounter(logging.Handler):
+    """Counts ERROR records per update: most handlers catch and log their own exceptions."""
+
+    def __init__(self, counts):
+        super().__init__(level=logging.ERROR)
+        self.counts = counts
+
+    def emit(self, record):
+        context = log_pipeline.log_context.get() or {}
+        self.counts[context.get("update_id")] += 1
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, int(round(q / 100 * len(values) + 0.5)) - 1))
+    return values[index]
+
+
+class BenchUser:
+    """Synthetic user that builds raw Update payloads for the fake chat."""
+
+    def __init__(self, api, user_id):
+        self.api = api
+        self.user = {'id': user_id, 'is_bot': False, 'first_name': f"user{user_id}"}
+        self.chat = {'id': user_id, 'type': 'private'}
+
+    def _message(self, **extra):
+        message = {
+            'message_id': self.api.new_message_id(self.chat['id']),
+            'date': int(time.time()),
+            'chat': self.chat,
+            'from': self.user,
+        }
+        message.update(extra)
+        return {'update_id': next(_update_ids), 'message': message}
+
+    def command(self, text):
+        command = text.split()[0]
+        return self._message(text=text, entities=[{'type': 'bot_command', 'offset': 0, 'length': len(command)}])
+
+    def text(self, text):
+        return self._message(text=text)
+
+    def video(self, file_id, size):
+        return self._message(video={
+            'file_id': file_id, 'file_unique_id': file_id,
+            'width': 320, 'height': 240, 'duration': 2, 'file_size': size,
+        })
+
+    def callback(self, data):
+        return {
+            'update_id': next(_update_ids),
+            'callback_query': {
+                'id': str(next(_callback_ids)),
+                'from': self.user,
+                'chat_instance': str(self.chat['id']),
+                'data': data,
+                'message': {
+                    'message_id': self.api.new_message_id(self.chat['id']),
+                    'date': int(time.time()),
+                    'chat': self.chat,
+                    'from': BOT_USER,
+                    'text': 'menu',
+                },
+            },
+        }
+
+
+def scenario(name, user, video_file_id, video_size):
+    """Return the list of (step name, update payload factory) for a workload."""
+    if name == "upload":
+        return [
+            ("upload:video", lambda: user.video(video_file_id, video_size)),
+            ("upload:upload_full", lambda: user.callback("upload_full")),
+            ("upload:save_", lambda: user.callback(f"save_{BENCH_FOLDER}")),
+            ("upload:random_name", lambda: user.callback("random_name")),
+        ]
+    if name == "trim":
+        return [
+            ("trim:video", lambda: user.video(video_file_id, video_size)),
+            ("trim:upload_trim", lambda: user.callback("upload_trim")),
+            ("trim:start", lambda: user.text("0")),
+            ("trim:end", lambda: user.text("1")),
+            ("trim:save_", lambda: user.callback(f"save_{BENCH_FOLDER}")),
+            ("trim:random_name", lambda: user.callback("random_name")),
+        ]
+    if name == "multi_trim":
+        return [
+            ("multi_trim:video", lambda: user.video(video_file_id, video_size)),
+            ("multi_trim:upload_multi", lambda: user.callback("upload_multi")),
+            ("multi_trim:ranges", lambda: user.text("0-0.5, 1-1.5")),
+            ("multi_trim:split", lambda: user.callback("trim_multi_split")),
+            ("multi_trim:save_", lambda: user.callback(f"save_{BENCH_FOLDER}")),
+            ("multi_trim:random_name", lambda: user.callback("random_name")),
+        ]
+    if name == "browse":
+        return [
+            ("browse:/folders", lambda: user.command("/folders")),
+            ("browse:view_", lambda: user.callback(f"view_{BENCH_FOLDER}")),
+            ("browse:back_to_folders", lambda: user.callback("back_to_folders")),
+        ]
+    if name == "send_all":
+        return [("send_all:send_all_", lambda: user.callback(f"send_all_{BENCH_FOLDER}"))]
+    if name == "export":
+        return [("export:export_", lambda: user.callback(f"export_{BENCH_FOLDER}"))]
+    if name == "clear":
+        return [
+            ("clear:/clear", lambda: user.command("/clear")),
+            ("clear:clear_confirm", lambda: user.callback("clear_confirm")),
+        ]
+    raise ValueError(f"Unknown workload: {name}")
+
+
+async def run(args):
+    from telegram import Update
+    import_started = time.perf_counter()
+    import bot
+    import_time = time.perf_counter() - import_started
+
+    logging.getLogger().setLevel(args.log_level)
+    work_dir = tempfile.mkdtemp(prefix="bench_")
+    config.RESOURCES_DIR = work_dir
+    api = FakeBotAPI(latency=args.api_latency_ms / 1000, local_mode=args.local_mode)
+    api.start()
+
+    # Исходное видео: настоящее mp4 (если есть ffmpeg) или случайные байты
+    sample_path = os.path.join(tempfile.mkdtemp(prefix="bench_src_"), "sample.mp4")
+    has_real_video = make_sample_video(sample_path)
+    if not has_real_video:
+        with open(sample_path, "wb") as f:
+            f.write(os.urandom(args.video_kb * 1024))
+    with open(sample_path, "rb") as f:
+        sample = f.read()
+    api.add_file("bench_video", "videos/bench_video.mp4", sample)
+
+    workloads = [w for w in args.workload if has_real_video or w not in VIDEO_WORKLOADS]
+    if len(workloads) != len(args.workload):
+        print("ffmpeg не найден: сценарии с обрезкой пропущены", file=sys.stderr)
+
+    folder_path = os.path.join(work_dir, BENCH_FOLDER)
+    os.makedirs(folder_path)
+    for i in range(args.folder_size):
+        shutil.copyfile(sample_path, os.path.join(folder_path, f"seed_{i:04d}.mp4"))
+
+    application = bot.build_application(
+        token=TOKEN, base_url=api.base_url, base_file_url=api.base_file_url, local_mode=args.local_mode
+    )
+    latencies = defaultdict(list)
+    handler_times = defaultdict(list)
+    # Шаг каждого обновления - чтобы отнести к нему ошибки, в том числе фоновых задач
+    update_steps = {}
+    update_errors = defaultdict(int)
+
+    async def on_error(update, context):
+        update_errors[getattr(update, "update_id", None)] += 1
+
+    application.add_error_handler(on_error)
+    error_log_counter = ErrorLogCounter(update_errors)
+    logging.getLogger().addHandler(error_log_counter)
+    # start(): задачи application.create_task отслеживаются и дожидаются в stop()
+    await application.initialize()
+    await application.start()
+    # Как и в проде, не обрабатываем больше обновлений одновременно, чем разрешено
+    gate = asyncio.Semaphore(application.concurrent_updates)
+
+    async def submit(step, payload):
+        update = Update.de_json(payload, application.bot)
+        update_steps[update.update_id] = step
+        queued = time.perf_counter()
+        async with gate:
+            started = time.perf_counter()
+            await application.process_update(update)
+            finished = time.perf_counter()
+        latencies[step].append(finished - queued)
+        handler_times[step].append(finished - started)
+
+    async def user_loop(index):
+        user = BenchUser(api, 10000 + index)
+        steps = scenario(workloads[index % len(workloads)], user, "bench_video", len(sample))
+        for _ in range(args.rounds):
+            for step, factory in steps:
+                await submit(step, factory())
+
+    if args.tracemalloc:
+        tracemalloc.start()
+    started = time.perf_counter()
+    await asyncio.gather(*(user_loop(i) for i in range(args.users)))
+    elapsed = time.perf_counter() - started
+    traced_peak = tracemalloc.get_traced_memory()[1] if args.tracemalloc else None
+    if args.tracemalloc:
+        tracemalloc.stop()
+
+    # Фоновые задачи (квота, удаление папок, альбомы) - до подсчёта ошибок
+    drain_started = time.perf_counter()
+    await application.stop()
+    drain_time = time.perf_counter() - drain_started
+    await application.shutdown()
+    logging.getLogger().removeHandler(error_log_counter)
+    errors = defaultdict(int)
+    for update_id, count in update_errors.items():
+        errors[update_steps.get(update_id, "(вне обновлений)")] += count
+    api.stop()
+    if api.local_dir:
+        shutil.rmtree(api.local_dir, ignore_errors=True)
+    shutil.rmtree(work_dir, ignore_errors=True)
+    shutil.rmtree(os.path.dirname(sample_path), ignore_errors=True)
+
+    total = sum(len(v) for v in latencies.values())
+    result = {
+        'users': args.users,
+        'rounds': args.rounds,
+        'workloads': workloads,
+        'updates': total,
+        'elapsed_s': elapsed,
+        'drain_s': drain_time,
+        'import_bot_s': import_time,
+        'throughput_ups': total / elapsed if elapsed else 0.0,
+        'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'traced_peak_mb': traced_peak / (1024 * 1024) if traced_peak is not None else None,
+        'api_calls': dict(api.calls),
+        'uploaded_mb': api.uploaded_bytes / (1024 * 1024),
+        'local_sends': api.local_sends,
+        'steps': {
+            step: {
+                'count': len(values),
+                'errors': errors[step],
+                'p50_ms': percentile(values, 50) * 1000,
+                'p99_ms': percentile(values, 99) * 1000,
+                'handler_p50_ms': percentile(handler_times[step], 50) * 1000,
+                'handler_p99_ms': percentile(handler_times[step], 99) * 1000,
+            }
+            for step, values in sorted(latencies.items())
+        },
+        'unattributed_errors': errors["(вне обновлений)"],
+    }
+    return result
+
+
+def print_report(result):
+    print(f"Пользователей: {result['users']}, раундов: {result['rounds']}, сценарии: {', '.join(result['workloads'])}")
+    print(f"Импорт bot: {result['import_bot_s']:.2f} с")
+    print(f"Обновлений: {result['updates']} за {result['elapsed_s']:.2f} с -> {result['throughput_ups']:.1f} upd/s, "
+          f"фоновые задачи завершены за {result['drain_s']:.2f} с")
+    memory = f"Память: max RSS {result['max_rss_mb']:.1f} МБ"
+    if result['traced_peak_mb'] is not None:
+        memory += f", пик tracemalloc {result['traced_peak_mb']:.1f} МБ"
+    print(memory)
+    print(f"Отправлено в Bot API: {result['uploaded_mb']:.1f} МБ (+{result['local_sends']} видео путём), "
+          f"вызовов: {sum(result['api_calls'].values())}")
+    print()
+    print(f"{'шаг':28} {'n':>6} {'err':>4} {'p50 мс':>9} {'p99 мс':>9} {'h.p50':>9} {'h.p99':>9}")
+    for step, s in result['steps'].items():
+        print(f"{step:28} {s['count']:6d} {s['errors']:4d} {s['p50_ms']:9.1f} {s['p99_ms']:9.1f} "
+              f"{s['handler_p50_ms']:9.1f} {s['handler_p99_ms']:9.1f}")
+    if result['unattributed_errors']:
+        print(f"Ошибок вне обновлений: {result['unattributed_errors']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline load test against a fake Bot API server")
+    parser.add_argument("--users", type=int, default=10, help="одновременных пользователей")
+    parser.add_argument("--rounds", type=int, default=3, help="повторов сценария на пользователя")
+    parser.add_argument("--workload", nargs="+", choices=WORKLOADS, default=list(WORKLOADS))
+    parser.add_argument("--folder-size", type=int, default=20, help="видео в папке для browse/send_all")
+    parser.add_argument("--video-kb", type=int, default=512, help="размер видео, если нет ffmpeg")
+    parser.add_argument("--api-latency-ms", type=float, default=0.0, help="искусственная задержка Bot API")
+    parser.add_argument("--local-mode", action="store_true", help="эмулировать telegram-bot-api --local")
+    parser.add_argument("--tracemalloc", action="store_true", help="замерять пик аллокаций Python")
+    parser.add_argument("--log-level", default="WARNING")
+    parser.add_argument("--json", help="сохранить результат в JSON")
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+    print_report(result)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,28 +1,48 @@
+import time
+# Момент старта - для замера времени холодного запуска
+STARTED_AT = time.perf_counter()
+
 import logging
-import shutil
 import asyncio
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, InputMediaVideo
-from telegram.ext import Application, CommandHandler, ContextTypes, MessageHandler, filters, CallbackQueryHandler, ConversationHandler
+from telegram.ext import Application, CommandHandler, ContextTypes, MessageHandler, filters, CallbackQueryHandler, ConversationHandler, TypeHandler
 import config
+from profiler import SamplingProfiler
+from callback_router import CallbackRouter, TimingMiddleware, allow_users
+from scheduler import FairScheduler
+from library import Library
+from state_store import StateStore, SharedDict
+import io
 import os
+from pathlib import Path
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from moviepy.editor import VideoFileClip
-# from moviepy import VideoFileClip
-from pytubefix import YouTube
-import instaloader
+# moviepy, pytubefix и instaloader загружаются лениво при первом использовании
+import storage
+import media
+import zip_export
+import cluster
+from lazy_imports import get_video_file_clip, get_youtube, warm_up_in_background
+import instagram
 import re
+import sys
 import hashlib
+import log_pipeline
 
 
-# Enable logging
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
+# Логи пишутся через очередь фоновым потоком, event loop не ждёт вывода
+log_pipeline.setup(
+    level=config.LOG_LEVEL,
+    fmt=config.LOG_FORMAT,
+    queue_size=config.LOG_QUEUE_SIZE,
+    sampling=config.LOG_SAMPLING,
+    stream=sys.stderr
 )
 logger = logging.getLogger(__name__)
 
-# Максимальный размер файла (10 МБ в байтах)
-MAX_FILE_SIZE = 10 * 1024 * 1024
+# Максимальный размер файла в байтах (10 МБ для облачного Bot API)
+MAX_FILE_SIZE = config.MAX_FILE_SIZE_MB * 1024 * 1024
 
 # Максимальная длина callback_data для Telegram
 MAX_CALLBACK_DATA_LEN = 64
@@ -30,8 +50,58 @@ MAX_CALLBACK_DATA_LEN = 64
 # Словарь для хранения выбранной папки для каждого пользователя
 user_folders = {}
 
-# Словарь для хранения временных файлов
-temp_videos = {}
+# Общее состояние процессов при запуске с воркерами (BOT_WORKERS > 0)
+state = StateStore(config.STATE_DB_PATH) if config.BOT_WORKERS else None
+
+# Словарь для хранения временных файлов; с воркерами - в общем SQLite,
+# поэтому вложенные словари после изменения записываются обратно целиком
+temp_videos = SharedDict(state, 'temp_videos') if state else {}
+
+# Фоновые задачи превью по пользователям (только в памяти процесса)
+preview_futures = {}
+
+# Видео из альбомов, ожидающие остальных элементов: (user_id, media_group_id) -> данные
+album_buffers = {}
+
+# Маршрутизатор callback_data инлайн-кнопок и статистика времени по маршрутам
+callback_router = CallbackRouter()
+callback_router.use(log_pipeline.log_context_middleware)
+callback_timing = callback_router.use(TimingMiddleware())
+# Маршруты удаления доступны только DELETE_USER_IDS, если список задан
+delete_middleware = (
+    [allow_users(config.DELETE_USER_IDS, "У вас нет прав на удаление.")] if config.DELETE_USER_IDS else []
+)
+
+# Очередь тяжёлых операций (обрезка, скачивание по ссылке, отправка папки)
+heavy_jobs = FairScheduler(
+    max_concurrent=config.HEAVY_JOBS_CONCURRENCY,
+    per_user_concurrent=config.HEAVY_JOBS_PER_USER,
+    byte_rate=config.USER_BYTE_RATE_KB * 1024,
+    weights=config.USER_WEIGHTS
+)
+
+# Учёт просмотров, кэш file_id Telegram и квота диска для библиотеки видео
+library = Library(
+    quota_bytes=config.DISK_QUOTA_MB * 1024 * 1024,
+    cold_bitrate=config.COLD_BITRATE or None,
+    store=state
+)
+
+# Фоновый пул для превью ключевых кадров, чтобы они не конкурировали с обрезкой
+preview_executor = ThreadPoolExecutor(max_workers=config.PREVIEW_THREADS, thread_name_prefix="preview")
+
+# Долгоживущие сессии Instagram с паузами после 429
+instagram_pool = instagram.InstagramPool(
+    size=config.INSTAGRAM_POOL_SIZE,
+    usernames=config.INSTAGRAM_USERNAMES,
+    session_dir=config.INSTAGRAM_SESSION_DIR or None,
+    backoff=config.INSTAGRAM_BACKOFF_SECONDS,
+    max_backoff=config.INSTAGRAM_MAX_BACKOFF_SECONDS,
+    max_wait=config.INSTAGRAM_MAX_WAIT_SECONDS
+)
+
+# Текущая сессия профилирования (одна на весь бот)
+profile_session = None
 
 # Состояния для ConversationHandler
 WAITING_FOLDER_NAME = 1
@@ -47,16 +117,104 @@ def safe_callback_data(prefix, *args):
     data = prefix + '_' + '_'.join(safe_args)
     return data[:MAX_CALLBACK_DATA_LEN]
 
+def folder_payload(raw):
+    """Decode a folder name from callback_data; rejects names that leave RESOURCES_DIR."""
+    if raw in ('', '.', '..') or os.sep in raw or (os.altsep and os.altsep in raw):
+        raise ValueError(f"недопустимое имя папки {raw!r}")
+    return raw
+
 def get_file_id(folder, filename):
     return hashlib.md5(f"{folder}/{filename}".encode()).hexdigest()
 
+def make_temp_filename(user_id, timestamp, suffix=""):
+    """Name of a staged upload; includes the user id so parallel uploads don't collide."""
+    return f"temp_{user_id}_{timestamp}{suffix}.mp4"
+
+def trim_video_file(video_path, start_time, end_time, output_path):
+    """Cut [start_time, end_time] out of a video (blocking, run in an executor)."""
+    VideoFileClip = get_video_file_clip()
+    # Обрезаем видео используя новый синтаксис
+    clip = (
+        VideoFileClip(video_path)
+        .subclip(start_time, end_time)
+    )
+    try:
+        clip.write_videofile(output_path, logger=None)
+    finally:
+        clip.close()  # Закрываем клип после использования
+
+class QueueStatus:
+    """Status message that shows the position in the heavy-jobs queue.
+
+    Если передано существующее статусное сообщение - редактирует его,
+    иначе создаёт ответ на `message` только когда это нужно.
+    """
+
+    def __init__(self, message, status_message=None):
+        self.message = message
+        self.status_message = status_message
+
+    async def show(self, text):
+        if self.status_message is None:
+            self.status_message = await self.message.reply_text(text)
+        else:
+            await self.status_message.edit_text(text)
+
+    async def show_position(self, position):
+        await self.show(f"⏳ Задача в очереди, позиция {position}...")
+
+    async def delete(self):
+        if self.status_message is not None:
+            try:
+                await self.status_message.delete()
+            except Exception:
+                pass
+            self.status_message = None
+
+async def reply_video_file(message, video_path, caption):
+    """Reply with a video from disk.
+
+    С локальным Bot API сервером (--local) передаём только путь к файлу,
+    иначе загружаем содержимое по HTTP.
+    """
+    if message.get_bot().local_mode:
+        return await message.reply_video(video=Path(video_path), caption=caption)
+    with open(video_path, 'rb') as video_file:
+        return await message.reply_video(video=video_file, caption=caption)
+
+async def download_video_file(file, temp_path):
+    """Store a received file at temp_path.
+
+    С локальным Bot API сервером (--local) file_path - путь на диске сервера:
+    файл связывается жёсткой ссылкой или копируется в пуле файловых операций.
+    download_to_drive копировал бы его синхронно прямо в event loop.
+    """
+    if file.get_bot().local_mode:
+        await storage.link_or_copy(file.file_path, temp_path)
+    else:
+        await file.download_to_drive(temp_path)
+
+async def send_library_video(message, folder_name, video_name, caption):
+    """Send a video from the library, by cached file_id when possible."""
+    file_id = library.file_id(folder_name, video_name)
+    if file_id:
+        try:
+            await message.reply_video(video=file_id, caption=caption)
+            await library.record_access(folder_name, video_name)
+            return
+        except Exception as e:
+            logger.error(f"Не удалось отправить видео по file_id, отправляю файл: {e}")
+    video_path = os.path.join(config.RESOURCES_DIR, folder_name, video_name)
+    sent = await reply_video_file(message, video_path, caption=caption)
+    await library.record_access(folder_name, video_name, sent.video.file_id if sent.video else None)
+
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Send a message when the command /start is issued."""
     await update.message.reply_text('Привет! Я бот для работы с видео. Используйте /help для просмотра команд.')
 
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Send a message when the command /help is issued."""
-    help_text = """
+    help_text = f"""
 Доступные команды:
 /start - Запустить бота
 /help - Показать это сообщение
@@ -67,9 +225,10 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 /delete_video - Удалить конкретное видео из папки
 /clear - Очистить чат от сообщений бота
 /download_from_url - Скачать видео с YouTube или Instagram
+/export - Скачать папку zip-архивом (можно указать имя папки сразу)
 
 Чтобы загрузить видео, просто отправьте его мне. После загрузки вы сможете выбрать папку для сохранения.
-Максимальный размер - 10 МБ.
+Максимальный размер - {config.MAX_FILE_SIZE_MB} МБ.
     """
     await update.message.reply_text(help_text)
 
@@ -80,9 +239,9 @@ async def create_folder(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if context.args:
             # Если имя папки передано сразу с командой
             folder_name = context.args[0]
-            logger.info(f"Creating folder with name: {folder_name}")
+            logger.info("Creating folder with name: %s", folder_name)
             folder_path = os.path.join(config.RESOURCES_DIR, folder_name)
-            os.makedirs(folder_path, exist_ok=True)
+            await storage.makedirs(folder_path)
             await update.message.reply_text(f"Папка '{folder_name}' успешно создана!")
         else:
             # Если имя папки нужно запросить
@@ -103,9 +262,9 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if context.user_data.get('waiting_for_folder_name'):
         try:
             folder_name = update.message.text
-            logger.info(f"Creating folder with name: {folder_name}")
+            logger.info("Creating folder with name: %s", folder_name)
             folder_path = os.path.join(config.RESOURCES_DIR, folder_name)
-            os.makedirs(folder_path, exist_ok=True)
+            await storage.makedirs(folder_path)
             await update.message.reply_text(f"Папка '{folder_name}' успешно создана!")
             context.user_data.clear()
         except Exception as e:
@@ -156,32 +315,55 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 )
                 return
             
-            # Обрезаем видео используя новый синтаксис
+            # Сбрасываем ожидание до очереди: повторное сообщение со временем,
+            # пришедшее во время обрезки, не должно запустить вторую обрезку
+            context.user_data.clear()
             user_id = update.effective_user.id
             if user_id in temp_videos:
                 video_path = temp_videos[user_id]['path']
                 try:
-                    clip = (
-                        VideoFileClip(video_path)
-                        .subclip(start_time, end_time)
-                    )
                     temp_path = video_path.replace('.mp4', '_trimmed.mp4')
-                    clip.write_videofile(temp_path)
-                    clip.close()  # Закрываем клип после использования
+                    # Обрезка - тяжёлая операция: ждём свою очередь и кодируем вне event loop
+                    status = QueueStatus(update.message)
+                    async with heavy_jobs.slot(user_id, on_position=status.show_position):
+                        await status.show("✂️ Обрезаю видео...")
+                        await asyncio.get_running_loop().run_in_executor(
+                            None, trim_video_file, video_path, start_time, end_time, temp_path
+                        )
+                    await status.delete()
                     
                     # Обновляем путь к видео
-                    temp_videos[user_id]['path'] = temp_path
-                    os.remove(video_path)  # Удаляем оригинальный файл
+                    temp_video = temp_videos[user_id]
+                    temp_video['path'] = temp_path
+                    temp_videos[user_id] = temp_video
+                    await storage.remove(video_path)  # Удаляем оригинальный файл
                     
                     # Показываем меню выбора папки
                     await show_folder_selection(update, context)
                 except Exception as e:
                     logger.error(f"Ошибка при обрезке видео: {e}")
                     await update.message.reply_text("Извините, произошла ошибка при обрезке видео.")
-            
-            context.user_data.clear()
         except ValueError:
             await update.message.reply_text("Пожалуйста, введите корректное число.")
+    elif context.user_data.get('waiting_for_trim_ranges'):
+        try:
+            ranges = media.parse_ranges(update.message.text, context.user_data.get('video_duration', 0))
+        except ValueError as e:
+            await update.message.reply_text(f"{e}\nПожалуйста, введите фрагменты ещё раз, например: 0-10, 15.5-20")
+            return
+        if len(ranges) > config.MAX_TRIM_SEGMENTS:
+            await update.message.reply_text(f"Можно указать не больше {config.MAX_TRIM_SEGMENTS} фрагментов.")
+            return
+        context.user_data['waiting_for_trim_ranges'] = False
+        context.user_data['trim_ranges'] = ranges
+        keyboard = [
+            [InlineKeyboardButton(f"📎 Отдельными видео ({len(ranges)})", callback_data="trim_multi_split")],
+            [InlineKeyboardButton("🔗 Склеить в одно видео", callback_data="trim_multi_concat")]
+        ]
+        await update.message.reply_text(
+            "Как сохранить фрагменты?",
+            reply_markup=InlineKeyboardMarkup(keyboard)
+        )
     elif context.user_data.get('waiting_for_url'):
         try:
             await handle_url(update, context)
@@ -195,8 +377,8 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def list_folders(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Show available folders."""
     try:
-        folders = [f for f in os.listdir(config.RESOURCES_DIR) 
-                  if os.path.isdir(os.path.join(config.RESOURCES_DIR, f))]
+        # Папки и число видео в них - одним обращением к пулу файловых операций
+        folders = await storage.folder_video_counts()
         
         if not folders:
             message = "Нет доступных папок."
@@ -207,13 +389,10 @@ async def list_folders(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
 
         keyboard = []
-        for folder in folders:
-            # Подсчет видео в папке
-            videos = [f for f in os.listdir(os.path.join(config.RESOURCES_DIR, folder)) 
-                     if f.endswith(('.mp4', '.avi', '.mov'))]
+        for folder, video_count in folders:
             keyboard.append([
                 InlineKeyboardButton(
-                    f"📁 {folder} ({len(videos)} видео)", 
+                    f"📁 {folder} ({video_count} видео)", 
                     callback_data=safe_callback_data("view", folder)
                 )
             ])
@@ -241,6 +420,10 @@ async def list_folders(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def handle_video(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle incoming video files."""
+    if update.message.media_group_id:
+        # Видео из альбома собираем вместе и сохраняем одной пачкой
+        await collect_album_video(update, context)
+        return
     try:
         video = update.message.video
         user_id = update.effective_user.id
@@ -248,7 +431,7 @@ async def handle_video(update: Update, context: ContextTypes.DEFAULT_TYPE):
         # Проверка размера файла
         if video.file_size > MAX_FILE_SIZE:
             await update.message.reply_text(
-                f"Извините, файл слишком большой. Максимальный размер - 10 МБ."
+                f"Извините, файл слишком большой. Максимальный размер - {config.MAX_FILE_SIZE_MB} МБ."
             )
             return
 
@@ -257,11 +440,11 @@ async def handle_video(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         # Создаем временное имя файла
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        temp_filename = f"temp_{timestamp}.mp4"
+        temp_filename = make_temp_filename(user_id, timestamp)
         temp_path = os.path.join(config.RESOURCES_DIR, temp_filename)
         
         # Скачиваем файл во временную папку
-        await file.download_to_drive(temp_path)
+        await download_video_file(file, temp_path)
         
         # Сохраняем информацию о временном файле
         temp_videos[user_id] = {
@@ -269,13 +452,11 @@ async def handle_video(update: Update, context: ContextTypes.DEFAULT_TYPE):
             'size': video.file_size,
             'timestamp': timestamp
         }
+        # Пока пользователь выбирает режим, в фоне готовим превью для обрезки
+        start_preview(user_id, temp_path)
         
         # Показываем меню выбора режима загрузки
-        keyboard = [
-            [InlineKeyboardButton("📤 Загрузить видео полностью", callback_data="upload_full")],
-            [InlineKeyboardButton("✂️ Обрезать видео", callback_data="upload_trim")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        reply_markup = upload_mode_keyboard()
         await update.message.reply_text(
             "Выберите режим загрузки видео:",
             reply_markup=reply_markup
@@ -285,11 +466,136 @@ async def handle_video(update: Update, context: ContextTypes.DEFAULT_TYPE):
         logger.error(f"Ошибка при загрузке видео: {e}")
         await update.message.reply_text("Извините, произошла ошибка при загрузке видео.")
 
+async def collect_album_video(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Buffer a video from a media group until the whole album has arrived."""
+    user_id = update.effective_user.id
+    key = (user_id, update.message.media_group_id)
+    album = album_buffers.get(key)
+    if album is None:
+        album = album_buffers[key] = {'update': update, 'videos': [], 'task': None}
+    album['videos'].append(update.message.video)
+    # Telegram присылает элементы альбома отдельными обновлениями - ждём паузу после последнего
+    if album['task'] is not None:
+        album['task'].cancel()
+    # Через application: ошибка задачи попадёт в обработчики ошибок PTB, а не потеряется
+    album['task'] = context.application.create_task(finish_album(key, context), update=update)
+
+async def finish_album(key, context: ContextTypes.DEFAULT_TYPE):
+    """Download all videos of an album concurrently and show one folder selection."""
+    await asyncio.sleep(config.ALBUM_COLLECT_DELAY)
+    album = album_buffers.pop(key)
+    update = album['update']
+    user_id = update.effective_user.id
+    videos = [v for v in album['videos'] if v.file_size <= MAX_FILE_SIZE]
+    skipped = len(album['videos']) - len(videos)
+
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    semaphore = asyncio.Semaphore(config.ALBUM_DOWNLOAD_CONCURRENCY)
+    status_message = None
+    done = 0
+
+    async def download(i, video):
+        nonlocal done
+        temp_path = os.path.join(config.RESOURCES_DIR, make_temp_filename(user_id, timestamp, f"_{i}"))
+        async with semaphore:
+            try:
+                file = await context.bot.get_file(video.file_id)
+                await download_video_file(file, temp_path)
+            except Exception as e:
+                logger.error(f"Ошибка при загрузке видео из альбома: {e}")
+                await storage.remove_if_exists(temp_path)
+                return None
+        done += 1
+        try:
+            await status_message.edit_text(f"⏳ Загружено {done} из {len(videos)} видео...")
+        except Exception:
+            pass
+        return temp_path, video.file_size
+
+    try:
+        status_message = await update.message.reply_text(f"⏳ Загружаю {len(videos)} видео из альбома...")
+        status = QueueStatus(update.message, status_message)
+        async with heavy_jobs.slot(user_id, on_position=status.show_position):
+            results = await asyncio.gather(*(download(i, v) for i, v in enumerate(videos, 1)))
+        results = [r for r in results if r is not None]
+        if not results:
+            await status_message.edit_text("Извините, не удалось загрузить видео из альбома.")
+            return
+        heavy_jobs.charge(user_id, sum(size for _, size in results))
+
+        paths = [path for path, _ in results]
+        temp_videos[user_id] = {
+            'path': paths[0],
+            'parts': paths,
+            'size': sum(size for _, size in results),
+            'timestamp': timestamp
+        }
+        message = f"✅ Загружено видео: {len(paths)}"
+        if skipped or len(paths) < len(videos):
+            message += f" (пропущено: {skipped + len(videos) - len(paths)}, максимальный размер - {config.MAX_FILE_SIZE_MB} МБ)"
+        await status_message.edit_text(message)
+        # Одна общая папка для всего альбома
+        await show_folder_selection(update, context)
+    except Exception as e:
+        logger.error(f"Ошибка при загрузке альбома: {e}")
+        if status_message is not None:
+            await status_message.edit_text("Извините, произошла ошибка при загрузке видео.")
+        else:
+            await update.message.reply_text("Извините, произошла ошибка при загрузке видео.")
+
+def start_preview(user_id, video_path):
+    """Start building the keyframe sprite for a staged video in the background."""
+    if not config.PREVIEW_FRAMES:
+        return
+    future = asyncio.get_running_loop().run_in_executor(
+        preview_executor, media.keyframe_sprite, video_path, config.PREVIEW_FRAMES, config.PREVIEW_WIDTH
+    )
+    future.add_done_callback(partial(_log_preview_error, user_id))
+    preview_futures[user_id] = future
+
+def _log_preview_error(user_id, future):
+    # Превью, которое уже не нужно (видео сохранено или заменено), не логируем
+    if preview_futures.get(user_id) is not future:
+        return
+    if not future.cancelled() and future.exception() is not None:
+        logger.error(f"Ошибка при создании превью: {future.exception()}")
+
+def discard_preview(user_id):
+    """Drop the pending preview once the staged file is moved away."""
+    future = preview_futures.pop(user_id, None)
+    if future is not None:
+        future.cancel()
+
+async def send_preview(message, user_id):
+    """Send the keyframe sprite of the staged video once, before the user enters trim times."""
+    future = preview_futures.pop(user_id, None)
+    if future is None:
+        return
+    try:
+        sprite = await asyncio.wait_for(asyncio.shield(future), timeout=config.PREVIEW_WAIT_SECONDS)
+        if sprite:
+            await message.reply_photo(
+                photo=sprite,
+                caption="🖼 Ключевые кадры видео, под каждым - время в секундах"
+            )
+    except asyncio.TimeoutError:
+        logger.info("Превью не готово вовремя, пропускаем")
+    except Exception as e:
+        logger.error(f"Ошибка при отправке превью: {e}")
+
+def upload_mode_keyboard():
+    """Keyboard for choosing how to upload a staged video."""
+    keyboard = [
+        [InlineKeyboardButton("📤 Загрузить видео полностью", callback_data="upload_full")],
+        [InlineKeyboardButton("✂️ Обрезать видео", callback_data="upload_trim")],
+        [InlineKeyboardButton("✂️ Вырезать несколько фрагментов", callback_data="upload_multi")]
+    ]
+    return InlineKeyboardMarkup(keyboard)
+
 async def show_folder_selection(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Show folder selection keyboard for video saving."""
     try:
-        folders = [f for f in os.listdir(config.RESOURCES_DIR) 
-                  if os.path.isdir(os.path.join(config.RESOURCES_DIR, f))]
+        folders = await storage.list_folders()
         
         if not folders:
             message = "Нет доступных папок. Создайте папку командой /create_folder"
@@ -330,7 +636,9 @@ async def show_filename_selection(update: Update, context: ContextTypes.DEFAULT_
     user_id = update.effective_user.id
     
     # Сохраняем выбранную папку
-    temp_videos[user_id]['selected_folder'] = folder_name
+    temp_video = temp_videos[user_id]
+    temp_video['selected_folder'] = folder_name
+    temp_videos[user_id] = temp_video
     
     keyboard = [
         [InlineKeyboardButton("Использовать случайное имя", callback_data="random_name")],
@@ -368,22 +676,43 @@ async def save_video(update: Update, context: ContextTypes.DEFAULT_TYPE, filenam
     
     temp_video = temp_videos[user_id]
     folder_name = temp_video['selected_folder']
+    # Файл сейчас переместится - превью для обрезки больше не понадобится
+    discard_preview(user_id)
     
     # Если имя файла не указано, генерируем случайное
     if not filename:
         filename = f"video_{temp_video['timestamp']}.mp4"
     
-    final_path = os.path.join(config.RESOURCES_DIR, folder_name, filename)
+    # Несколько видео (нарезка на части) сохраняются с номерами: имя_1.mp4, имя_2.mp4, ...
+    paths = temp_video.get('parts') or [temp_video['path']]
+    if len(paths) > 1:
+        base_name = filename[:-len('.mp4')] if filename.endswith('.mp4') else filename
+        filenames = [f"{base_name}_{i}.mp4" for i in range(1, len(paths) + 1)]
+    else:
+        filenames = [filename]
     
     try:
-        # Перемещаем файл в выбранную папку
-        os.rename(temp_video['path'], final_path)
+        for path, name in zip(paths, filenames):
+            final_path = os.path.join(config.RESOURCES_DIR, folder_name, name)
+            # Перемещаем файл в выбранную папку
+            await storage.rename(path, final_path)
+            # Новое содержимое - старый file_id под этим именем больше не годится
+            await library.forget(folder_name, name)
+        # Проверка квоты диска в фоне
+        context.application.create_task(library.enforce_quota(), update=update)
         
-        message = (
-            f"Видео успешно сохранено в папку '{folder_name}'!\n"
-            f"Имя файла: {filename}\n"
-            f"Размер: {round(temp_video['size'] / (1024 * 1024), 2)} МБ"
-        )
+        if len(filenames) > 1:
+            message = (
+                f"Видео успешно сохранены в папку '{folder_name}'!\n"
+                f"Файлов: {len(filenames)} ({filenames[0]} ... {filenames[-1]})\n"
+                f"Размер: {round(temp_video['size'] / (1024 * 1024), 2)} МБ"
+            )
+        else:
+            message = (
+                f"Видео успешно сохранено в папку '{folder_name}'!\n"
+                f"Имя файла: {filename}\n"
+                f"Размер: {round(temp_video['size'] / (1024 * 1024), 2)} МБ"
+            )
         
         if update.callback_query:
             await update.callback_query.edit_message_text(message)
@@ -402,29 +731,25 @@ async def save_video(update: Update, context: ContextTypes.DEFAULT_TYPE, filenam
         else:
             await update.message.reply_text(error_message)
         
-        # Удаляем временный файл в случае ошибки
-        if os.path.exists(temp_video['path']):
-            os.remove(temp_video['path'])
+        # Удаляем временные файлы в случае ошибки
+        for path in paths:
+            await storage.remove_if_exists(path)
         del temp_videos[user_id]
 
 async def delete_folder(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Show folder deletion keyboard."""
     try:
-        folders = [f for f in os.listdir(config.RESOURCES_DIR) 
-                  if os.path.isdir(os.path.join(config.RESOURCES_DIR, f))]
+        folders = await storage.folder_video_counts()
         
         if not folders:
             await update.message.reply_text("Нет доступных папок для удаления.")
             return
 
         keyboard = []
-        for folder in folders:
-            # Подсчет видео в папке
-            videos = [f for f in os.listdir(os.path.join(config.RESOURCES_DIR, folder)) 
-                     if f.endswith(('.mp4', '.avi', '.mov'))]
+        for folder, video_count in folders:
             keyboard.append([
                 InlineKeyboardButton(
-                    f"🗑 {folder} ({len(videos)} видео)", 
+                    f"🗑 {folder} ({video_count} видео)", 
                     callback_data=safe_callback_data("delete", folder)
                 )
             ])
@@ -456,7 +781,7 @@ async def clear_chat(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def delete_video(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Показывает список папок для выбора удаления видео."""
     try:
-        folders = [f for f in os.listdir(config.RESOURCES_DIR) if os.path.isdir(os.path.join(config.RESOURCES_DIR, f))]
+        folders = await storage.list_folders()
         if not folders:
             await update.message.reply_text("Нет доступных папок для удаления видео.")
             return
@@ -479,306 +804,421 @@ async def delete_video(update: Update, context: ContextTypes.DEFAULT_TYPE):
         logger.error(f"Ошибка при показе списка папок для удаления видео: {e}")
         await update.message.reply_text("Извините, произошла ошибка при получении списка папок.")
 
-async def folder_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+def find_file_by_id(context, file_id):
+    """Ищет файл по id среди сохранённых file_map_<папка>."""
+    for key in context.user_data:
+        if key.startswith("file_map_"):
+            file_map = context.user_data[key]
+            if file_id in file_map:
+                folder_name = key.replace("file_map_", "")
+                return folder_name, file_map[file_id]
+    return None, None
+
+@callback_router.route("upload_full", exact=True)
+async def upload_full_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, payload):
+    # Показываем меню выбора папки
+    await show_folder_selection(update, context)
+
+@callback_router.route("upload_trim", exact=True)
+async def upload_trim_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, payload):
+    # Запрашиваем время начала обрезки
     query = update.callback_query
-    await query.answer()
-    
-    callback_data = query.data
- # --- Вспомогательные функции для поиска файла по id ---
-    def find_file_by_id(file_id):
-        for key in context.user_data:
-            if key.startswith("file_map_"):
-                file_map = context.user_data[key]
-                if file_id in file_map:
-                    folder_name = key.replace("file_map_", "")
-                    return folder_name, file_map[file_id]
-        return None, None
-
-    if callback_data == "upload_full":
+    user_id = update.effective_user.id
+    if user_id in temp_videos:
+        try:
+            # Только чтение метаданных ffmpeg и вне event loop - без импорта moviepy.editor
+            info = await asyncio.get_running_loop().run_in_executor(
+                None, media.probe_video, temp_videos[user_id]['path']
+            )
+            duration = info['duration']
+            await query.edit_message_text(
+                f"Длительность видео: {int(duration)} секунд\n"
+                f"Введите время начала обрезки (в секундах, от 0 до {int(duration)}):"
+            )
+            context.user_data['video_duration'] = duration
+            context.user_data['waiting_for_trim_start'] = True
+            await send_preview(query.message, user_id)
+        except Exception as e:
+            logger.error(f"Ошибка при получении длительности видео: {e}")
+            await query.edit_message_text("Извините, произошла ошибка при обработке видео.")
+
+@callback_router.route("upload_multi", exact=True)
+async def upload_multi_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, payload):
+    # Запрашиваем список фрагментов
+    query = update.callback_query
+    user_id = update.effective_user.id
+    if user_id in temp_videos:
+        try:
+            info = await asyncio.get_running_loop().run_in_executor(
+                None, media.probe_video, temp_videos[user_id]['path']
+            )
+            duration = info['duration']
+            await query.edit_message_text(
+                f"Длительность видео: {int(duration)} секунд\n"
+                f"Введите фрагменты в формате начало-конец через запятую (в секундах), например:\n"
+                f"0-10, 15.5-20, 30-45"
+            )
+            context.user_data['video_duration'] = duration
+            context.user_data['waiting_for_trim_ranges'] = True
+            await send_preview(query.message, user_id)
+        except Exception as e:
+            logger.error(f"Ошибка при получении длительности видео: {e}")
+            await query.edit_message_text("Извините, произошла ошибка при обработке видео.")
+
+@callback_router.route("trim_multi_split", exact=True)
+async def trim_multi_split_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, payload):
+    await cut_ranges(update, context, concat=False)
+
+@callback_router.route("trim_multi_concat", exact=True)
+async def trim_multi_concat_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, payload):
+    await cut_ranges(update, context, concat=True)
+
+async def cut_ranges(update: Update, context: ContextTypes.DEFAULT_TYPE, concat: bool):
+    """Cut the ranges entered by the user in one ffmpeg pass, then ask for a folder."""
+    query = update.callback_query
+    user_id = update.effective_user.id
+    ranges = context.user_data.get('trim_ranges')
+    if user_id not in temp_videos or not ranges:
+        await query.edit_message_text("Ошибка: видео не найдено. Пожалуйста, загрузите видео снова.")
+        context.user_data.clear()
+        return
+    # Фрагменты забираем до очереди: повторное нажатие кнопки во время нарезки
+    # не запустит вторую нарезку в те же файлы
+    context.user_data.clear()
+
+    video_path = temp_videos[user_id]['path']
+    if concat:
+        output_paths = [video_path.replace('.mp4', '_joined.mp4')]
+    else:
+        output_paths = [video_path.replace('.mp4', f'_part{i}.mp4') for i in range(1, len(ranges) + 1)]
+    try:
+        status = QueueStatus(query.message, query.message)
+        async with heavy_jobs.slot(user_id, on_position=status.show_position):
+            await query.edit_message_text(f"✂️ Вырезаю фрагментов: {len(ranges)}...")
+            loop = asyncio.get_running_loop()
+            if concat:
+                await loop.run_in_executor(None, media.cut_and_concat, video_path, ranges, output_paths[0])
+            else:
+                await loop.run_in_executor(None, media.cut_segments, video_path, ranges, output_paths)
+        sizes = [await storage.getsize(path) for path in output_paths]
+        await storage.remove(video_path)  # Удаляем оригинальный файл
+        temp_video = temp_videos[user_id]
+        temp_video['path'] = output_paths[0]
+        temp_video['size'] = sum(sizes)
+        if not concat:
+            temp_video['parts'] = output_paths
+        temp_videos[user_id] = temp_video
         # Показываем меню выбора папки
         await show_folder_selection(update, context)
-    elif callback_data == "upload_trim":
-        # Запрашиваем время начала обрезки
-        user_id = update.effective_user.id
-        if user_id in temp_videos:
-            video_path = temp_videos[user_id]['path']
+    except Exception as e:
+        logger.error(f"Ошибка при нарезке видео: {e}")
+        for path in output_paths:
+            await storage.remove_if_exists(path)
+        await query.edit_message_text("Извините, произошла ошибка при обрезке видео.")
+
+# --- Удаление видео через выбор папки и файла ---
+@callback_router.route("delete_folder_", middleware=delete_middleware)
+async def delete_video_folder_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, folder_id):
+    query = update.callback_query
+    folder_map = context.user_data.get('delete_folder_map', {})
+    folder_name = folder_map.get(folder_id)
+    if not folder_name:
+        await query.edit_message_text("Папка не найдена.")
+        return
+    folder_path = os.path.join(config.RESOURCES_DIR, folder_name)
+    # Вытесненные видео тоже показываются в папке - их тоже можно удалить
+    videos = await storage.list_videos(folder_path) + await library.evicted(folder_name)
+    if not videos:
+        await query.edit_message_text(f"В папке '{folder_name}' нет видео.")
+        return
+    # Формируем карту id -> имя файла
+    video_map = {}
+    keyboard = []
+    for i, video in enumerate(videos):
+        video_id = f"v{i}_{hashlib.md5(video.encode()).hexdigest()[:8]}"
+        video_map[video_id] = video
+        keyboard.append([
+            InlineKeyboardButton(f"🗑 {video}", callback_data=f"delete_video_{video_id}")
+        ])
+    keyboard.append([InlineKeyboardButton("◀️ Назад", callback_data="delete_video_back_to_folders")])
+    context.user_data['delete_video_map'] = video_map
+    context.user_data['delete_selected_folder_id'] = folder_id
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    await query.edit_message_text(
+        f"Выберите видео для удаления из папки '{folder_name}':",
+        reply_markup=reply_markup
+    )
+
+@callback_router.route("delete_video_back_to_folders", exact=True)
+async def delete_video_back_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, payload):
+    # Показываем список папок заново
+    query = update.callback_query
+    folders = await storage.list_folders()
+    if not folders:
+        await query.edit_message_text("Нет доступных папок для удаления видео.")
+        return
+    folder_map = {}
+    keyboard = []
+    for i, folder in enumerate(folders):
+        folder_id = f"f{i}_{hashlib.md5(folder.encode()).hexdigest()[:8]}"
+        folder_map[folder_id] = folder
+        keyboard.append([
+            InlineKeyboardButton(f"📁 {folder}", callback_data=f"delete_folder_{folder_id}")
+        ])
+    context.user_data['delete_folder_map'] = folder_map
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    await query.edit_message_text(
+        "Выберите папку для удаления видео:",
+        reply_markup=reply_markup
+    )
+
+@callback_router.route("delete_video_", middleware=delete_middleware)
+async def delete_video_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, video_id):
+    query = update.callback_query
+    video_map = context.user_data.get('delete_video_map', {})
+    folder_map = context.user_data.get('delete_folder_map', {})
+    folder_id = context.user_data.get('delete_selected_folder_id')
+    folder_name = folder_map.get(folder_id)
+    video_name = video_map.get(video_id)
+    if not folder_name or not video_name:
+        await query.answer("❌ Видео не найдено")
+        return
+    folder_path = os.path.join(config.RESOURCES_DIR, folder_name)
+    video_path = os.path.join(folder_path, video_name)
+    try:
+        # Вытесненного видео на диске уже нет - достаточно убрать его из библиотеки
+        await storage.remove_if_exists(video_path)
+        await library.forget(folder_name, video_name)
+        await query.answer(f"✅ Видео '{video_name}' удалено")
+    except Exception as e:
+        logger.error(f"Ошибка при удалении видео: {e}")
+        await query.answer("❌ Ошибка при удалении видео")
+        return
+    # Обновляем список видео
+    videos = await storage.list_videos(folder_path) + await library.evicted(folder_name)
+    if not videos:
+        await query.edit_message_text(f"✅ Все видео из папки '{folder_name}' удалены.")
+        return
+    # Формируем новую карту и клавиатуру
+    video_map = {}
+    keyboard = []
+    for i, video in enumerate(videos):
+        vid_id = f"v{i}_{hashlib.md5(video.encode()).hexdigest()[:8]}"
+        video_map[vid_id] = video
+        keyboard.append([
+            InlineKeyboardButton(f"🗑 {video}", callback_data=f"delete_video_{vid_id}")
+        ])
+    keyboard.append([InlineKeyboardButton("◀️ Назад", callback_data="delete_video_back_to_folders")])
+    context.user_data['delete_video_map'] = video_map
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    await query.edit_message_text(
+        f"Выберите видео для удаления из папки '{folder_name}':",
+        reply_markup=reply_markup
+    )
+
+@callback_router.route("clear_confirm", exact=True)
+async def clear_confirm_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, payload):
+    # Очистка чата
+    query = update.callback_query
+    try:
+        # Получаем ID чата
+        chat_id = query.message.chat_id
+
+        # Отправляем сообщение о начале очистки
+        status_message = await query.message.reply_text("🔄 Начинаю очистку чата...")
+
+        deleted_count = 0
+        message_id = query.message.message_id
+        count_errors = 0
+
+        # Удаляем сообщения, начиная с текущего
+        while message_id > 0 and count_errors < 500:
             try:
-                with VideoFileClip(video_path) as clip:
-                    duration = clip.duration
-                    await query.edit_message_text(
-                        f"Длительность видео: {int(duration)} секунд\n"
-                        f"Введите время начала обрезки (в секундах, от 0 до {int(duration)}):"
+                # Пытаемся удалить сообщение
+                await context.bot.delete_message(
+                    chat_id=chat_id,
+                    message_id=message_id
+                )
+                deleted_count += 1
+                count_errors = 0
+
+                # Обновляем статус каждые 5 сообщений
+                if deleted_count % 5 == 0:
+                    await status_message.edit_text(
+                        f"🔄 Удалено сообщений: {deleted_count}..."
                     )
-                    context.user_data['video_duration'] = duration
-                    context.user_data['waiting_for_trim_start'] = True
+
+                # Уменьшаем ID для следующего сообщения
+                message_id -= 1
+                # Добавляем задержку
+                await asyncio.sleep(0.01)
+
             except Exception as e:
-                logger.error(f"Ошибка при получении длительности видео: {e}")
-                await query.edit_message_text("Извините, произошла ошибка при обработке видео.")
-    # --- Новый блок: удаление видео через выбор папки и файла ---
-    elif callback_data.startswith("delete_folder_"):
-        folder_id = callback_data.replace("delete_folder_", "")
-        folder_map = context.user_data.get('delete_folder_map', {})
-        folder_name = folder_map.get(folder_id)
-        if not folder_name:
-            await query.edit_message_text("Папка не найдена.")
-            return
-        folder_path = os.path.join(config.RESOURCES_DIR, folder_name)
-        videos = [f for f in os.listdir(folder_path) if f.endswith((".mp4", ".avi", ".mov"))]
-        if not videos:
-            await query.edit_message_text(f"В папке '{folder_name}' нет видео.")
-            return
-        # Формируем карту id -> имя файла
-        video_map = {}
-        keyboard = []
-        for i, video in enumerate(videos):
-            video_id = f"v{i}_{hashlib.md5(video.encode()).hexdigest()[:8]}"
-            video_map[video_id] = video
-            keyboard.append([
-                InlineKeyboardButton(f"🗑 {video}", callback_data=f"delete_video_{video_id}")
-            ])
-        keyboard.append([InlineKeyboardButton("◀️ Назад", callback_data="delete_video_back_to_folders")])
-        context.user_data['delete_video_map'] = video_map
-        context.user_data['delete_selected_folder_id'] = folder_id
-        reply_markup = InlineKeyboardMarkup(keyboard)
+                # Если сообщение не найдено или не может быть удалено, пропускаем его
+                message_id -= 1
+                count_errors += 1
+                continue
+
+
+        # Финальное сообщение
+        await status_message.edit_text(
+            f"✅ Чат успешно очищен!\nУдалено сообщений: {deleted_count}"
+        )
+
+    except Exception as e:
+        logger.error(f"Ошибка при очистке чата: {e}")
+        await query.edit_message_text("Извините, произошла ошибка при очистке чата.")
+
+@callback_router.route("clear_cancel", exact=True)
+async def clear_cancel_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, payload):
+    await update.callback_query.edit_message_text("❌ Очистка чата отменена.")
+
+@callback_router.route("save_", payload=folder_payload)
+async def save_folder_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, folder_name):
+    # Обработка выбора папки
+    await show_filename_selection(update, context, folder_name)
+
+@callback_router.route("random_name", exact=True)
+async def random_name_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, payload):
+    # Использовать случайное имя
+    await save_video(update, context)
+
+@callback_router.route("custom_name", exact=True)
+async def custom_name_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, payload):
+    # Запросить пользовательское имя
+    await update.callback_query.edit_message_text(
+        "Пожалуйста, отправьте желаемое имя файла (без расширения .mp4):\n"
+        "Или отправьте /cancel для отмены."
+    )
+    context.user_data['waiting_for_file_name'] = True
+    return WAITING_FILENAME
+
+@callback_router.route("delete_", payload=folder_payload, middleware=delete_middleware)
+async def delete_folder_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, folder_name):
+    # Обработка удаления папки
+    query = update.callback_query
+    folder_path = os.path.join(config.RESOURCES_DIR, folder_name)
+
+    try:
+        # Подсчет видео перед удалением
+        videos = await storage.list_videos(folder_path)
+        await query.edit_message_text(f"🗑 Удаляю папку '{folder_name}'...")
+    except Exception as e:
+        logger.error(f"Ошибка при удалении папки: {e}")
         await query.edit_message_text(
-            f"Выберите видео для удаления из папки '{folder_name}':",
-            reply_markup=reply_markup
+            "Извините, произошла ошибка при удалении папки."
         )
         return
-    elif callback_data == "delete_video_back_to_folders":
-        # Показываем список папок заново
-        folders = [f for f in os.listdir(config.RESOURCES_DIR) if os.path.isdir(os.path.join(config.RESOURCES_DIR, f))]
-        if not folders:
-            await query.edit_message_text("Нет доступных папок для удаления видео.")
-            return
-        folder_map = {}
-        keyboard = []
-        for i, folder in enumerate(folders):
-            folder_id = f"f{i}_{hashlib.md5(folder.encode()).hexdigest()[:8]}"
-            folder_map[folder_id] = folder
-            keyboard.append([
-                InlineKeyboardButton(f"📁 {folder}", callback_data=f"delete_folder_{folder_id}")
-            ])
-        context.user_data['delete_folder_map'] = folder_map
-        reply_markup = InlineKeyboardMarkup(keyboard)
+
+    # Удаляем папку со всем содержимым фоновой задачей, обработчик не ждёт диск
+    context.application.create_task(
+        delete_folder_job(query, folder_name, folder_path, len(videos)),
+        update=update
+    )
+
+async def delete_folder_job(query, folder_name, folder_path, video_count):
+    """Background folder deletion with progress in the callback message."""
+    async def report_progress(done, total):
+        await query.edit_message_text(f"🗑 Удаляю папку '{folder_name}': {done} из {total} файлов...")
+
+    try:
+        await storage.rmtree(folder_path, on_progress=report_progress)
+        await library.forget_folder(folder_name)
         await query.edit_message_text(
-            "Выберите папку для удаления видео:",
-            reply_markup=reply_markup
+            f"Папка '{folder_name}' успешно удалена!\n"
+            f"Удалено видео: {video_count}"
         )
-        return
-    elif callback_data.startswith("delete_video_"):
-        video_id = callback_data.replace("delete_video_", "")
-        video_map = context.user_data.get('delete_video_map', {})
-        folder_map = context.user_data.get('delete_folder_map', {})
-        folder_id = context.user_data.get('delete_selected_folder_id')
-        folder_name = folder_map.get(folder_id)
-        video_name = video_map.get(video_id)
-        if not folder_name or not video_name:
-            await query.answer("❌ Видео не найдено")
-            return
-        folder_path = os.path.join(config.RESOURCES_DIR, folder_name)
-        video_path = os.path.join(folder_path, video_name)
-        try:
-            os.remove(video_path)
-            await query.answer(f"✅ Видео '{video_name}' удалено")
-        except Exception as e:
-            logger.error(f"Ошибка при удалении видео: {e}")
-            await query.answer("❌ Ошибка при удалении видео")
-            return
-        # Обновляем список видео
-        videos = [f for f in os.listdir(folder_path) if f.endswith((".mp4", ".avi", ".mov"))]
+    except Exception as e:
+        logger.error(f"Ошибка при удалении папки: {e}")
+        await query.edit_message_text(
+            "Извините, произошла ошибка при удалении папки."
+        )
+
+@callback_router.route("view_", payload=folder_payload)
+async def view_folder_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, folder_name):
+    query = update.callback_query
+    folder_path = os.path.join(config.RESOURCES_DIR, folder_name)
+
+    try:
+        # Видео, вытесненные с диска по квоте, по-прежнему доступны по file_id
+        videos = await storage.list_videos(folder_path) + await library.evicted(folder_name)
+
         if not videos:
-            await query.edit_message_text(f"✅ Все видео из папки '{folder_name}' удалены.")
+            await query.edit_message_text(f"В папке '{folder_name}' нет видео.")
             return
-        # Формируем новую карту и клавиатуру
-        video_map = {}
+
+        # Создаем file_map и клавиатуру с видео
+        file_map = {get_file_id(folder_name, v): v for v in videos}
+        context.user_data[f"file_map_{folder_name}"] = file_map
         keyboard = []
-        for i, video in enumerate(videos):
-            vid_id = f"v{i}_{hashlib.md5(video.encode()).hexdigest()[:8]}"
-            video_map[vid_id] = video
+        for file_id, video in file_map.items():
             keyboard.append([
-                InlineKeyboardButton(f"🗑 {video}", callback_data=f"delete_video_{vid_id}")
+                InlineKeyboardButton(
+                    f"🎥 {video}",
+                    callback_data=safe_callback_data("play", file_id)
+                )
             ])
-        keyboard.append([InlineKeyboardButton("◀️ Назад", callback_data="delete_video_back_to_folders")])
-        context.user_data['delete_video_map'] = video_map
+
+        # Добавляем кнопки управления
+        keyboard.append([
+            InlineKeyboardButton("📤 Отправить все видео", callback_data=safe_callback_data("send_all", folder_name)),
+            InlineKeyboardButton("🗜 Архивом", callback_data=safe_callback_data("export", folder_name))
+        ])
+        keyboard.append([InlineKeyboardButton("◀️ Назад к папкам", callback_data="back_to_folders")])
+
         reply_markup = InlineKeyboardMarkup(keyboard)
         await query.edit_message_text(
-            f"Выберите видео для удаления из папки '{folder_name}':",
+            f"Видео в папке '{folder_name}':",
             reply_markup=reply_markup
         )
-        return
-    elif callback_data == "clear_confirm":
-        # Очистка чата
-        try:
-            # Получаем ID чата
-            chat_id = query.message.chat_id
-            
-            # Отправляем сообщение о начале очистки
-            status_message = await query.message.reply_text("🔄 Начинаю очистку чата...")
-            
-            deleted_count = 0
-            message_id = query.message.message_id
-            count_errors = 0
-            
-            # Удаляем сообщения, начиная с текущего
-            while message_id > 0 and count_errors < 500:
-                try:
-                    # Пытаемся удалить сообщение
-                    await context.bot.delete_message(
-                        chat_id=chat_id,
-                        message_id=message_id
-                    )
-                    deleted_count += 1
-                    count_errors = 0
-                    
-                    # Обновляем статус каждые 5 сообщений
-                    if deleted_count % 5 == 0:
-                        await status_message.edit_text(
-                            f"🔄 Удалено сообщений: {deleted_count}..."
-                        )
-                    
-                    # Уменьшаем ID для следующего сообщения
-                    message_id -= 1
-                    # Добавляем задержку
-                    await asyncio.sleep(0.01)
-                    
-                except Exception as e:
-                    # Если сообщение не найдено или не может быть удалено, пропускаем его
-                    message_id -= 1
-                    count_errors += 1
-                    continue
+    except Exception as e:
+        logger.error(f"Ошибка при просмотре видео в папке: {e}")
+        await query.edit_message_text(
+            "Извините, произошла ошибка при получении списка видео."
+        )
 
-            
-            # Финальное сообщение
-            await status_message.edit_text(
-                f"✅ Чат успешно очищен!\nУдалено сообщений: {deleted_count}"
-            )
-            
-        except Exception as e:
-            logger.error(f"Ошибка при очистке чата: {e}")
-            await query.edit_message_text("Извините, произошла ошибка при очистке чата.")
-    elif callback_data == "clear_cancel":
-        await query.edit_message_text("❌ Очистка чата отменена.")
-    elif callback_data.startswith("save_"):
-        # Обработка выбора папки
-        folder_name = callback_data.replace("save_", "")
-        await show_filename_selection(update, context, folder_name)
-    elif callback_data == "random_name":
-        # Использовать случайное имя
-        await save_video(update, context)
-    elif callback_data == "custom_name":
-        # Запросить пользовательское имя
+@callback_router.route("play_")
+async def play_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, file_id):
+    query = update.callback_query
+    folder_name, video_name = find_file_by_id(context, file_id)
+    if not folder_name or not video_name:
+        await query.edit_message_text("Ошибка: видео не найдено.")
+        return
+    try:
+        await send_library_video(query.message, folder_name, video_name, caption=f"🎥 {video_name}")
+    except Exception as e:
+        logger.error(f"Ошибка при отправке видео: {e}")
         await query.edit_message_text(
-            "Пожалуйста, отправьте желаемое имя файла (без расширения .mp4):\n"
-            "Или отправьте /cancel для отмены."
+            "Извините, произошла ошибка при отправке видео."
         )
-        context.user_data['waiting_for_file_name'] = True
-        return WAITING_FILENAME
-    elif callback_data.startswith("delete_"):
-        # Обработка удаления папки
-        folder_name = callback_data.replace("delete_", "")
-        folder_path = os.path.join(config.RESOURCES_DIR, folder_name)
-        
-        try:
-            # Подсчет видео перед удалением
-            videos = [f for f in os.listdir(folder_path) 
-                     if f.endswith(('.mp4', '.avi', '.mov'))]
-            
-            # Удаляем папку со всем содержимым
-            shutil.rmtree(folder_path)
-            
-            await query.edit_message_text(
-                f"Папка '{folder_name}' успешно удалена!\n"
-                f"Удалено видео: {len(videos)}"
-            )
-        except Exception as e:
-            logger.error(f"Ошибка при удалении папки: {e}")
-            await query.edit_message_text(
-                "Извините, произошла ошибка при удалении папки."
-            )
-    elif callback_data.startswith("view_"):
-        folder_name = callback_data.replace("view_", "")
-        folder_path = os.path.join(config.RESOURCES_DIR, folder_name)
-        
-        try:
-            videos = [f for f in os.listdir(folder_path) 
-                     if f.endswith(('.mp4', '.avi', '.mov'))]
-            
-            if not videos:
-                await query.edit_message_text(f"В папке '{folder_name}' нет видео.")
-                return
-            
-            # Создаем file_map и клавиатуру с видео
-            file_map = {get_file_id(folder_name, v): v for v in videos}
-            context.user_data[f"file_map_{folder_name}"] = file_map
-            keyboard = []
-            for file_id, video in file_map.items():
-                keyboard.append([
-                    InlineKeyboardButton(
-                        f"🎥 {video}", 
-                        callback_data=safe_callback_data("play", file_id)
-                    )
-                ])
-            
-            # Добавляем кнопки управления
-            keyboard.append([
-                InlineKeyboardButton("📤 Отправить все видео", callback_data=safe_callback_data("send_all", folder_name)),
-                InlineKeyboardButton("◀️ Назад к папкам", callback_data="back_to_folders")
-            ])
-            
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            await query.edit_message_text(
-                f"Видео в папке '{folder_name}':",
-                reply_markup=reply_markup
-            )
-        except Exception as e:
-            logger.error(f"Ошибка при просмотре видео в папке: {e}")
-            await query.edit_message_text(
-                "Извините, произошла ошибка при получении списка видео."
-            )
-    elif callback_data.startswith("play_"):
-        _, file_id = callback_data.split("_", 1)
-        folder_name, video_name = find_file_by_id(file_id)
-        if not folder_name or not video_name:
-            await query.edit_message_text("Ошибка: видео не найдено.")
+
+@callback_router.route("send_all_", payload=folder_payload)
+async def send_all_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, folder_name):
+    query = update.callback_query
+    folder_path = os.path.join(config.RESOURCES_DIR, folder_name)
+    try:
+        videos = await storage.list_videos(folder_path) + await library.evicted(folder_name)
+        if not videos:
+            await query.edit_message_text(f"В папке '{folder_name}' нет видео.")
             return
-        video_path = os.path.join(config.RESOURCES_DIR, folder_name, video_name)
-        try:
-            with open(video_path, 'rb') as video_file:
-                await query.message.reply_video(
-                    video=video_file,
-                    caption=f"🎥 {video_name}"
-                )
-        except Exception as e:
-            logger.error(f"Ошибка при отправке видео: {e}")
-            await query.edit_message_text(
-                "Извините, произошла ошибка при отправке видео."
-            )
-    elif callback_data.startswith("send_all_"):
-        folder_name = callback_data.replace("send_all_", "")
-        folder_path = os.path.join(config.RESOURCES_DIR, folder_name)
-        try:
-            videos = [f for f in os.listdir(folder_path) 
-                     if f.endswith(('.mp4', '.avi', '.mov'))]
-            if not videos:
-                await query.edit_message_text(f"В папке '{folder_name}' нет видео.")
-                return
-            # Сохраняем file_map для этой папки
-            file_map = {get_file_id(folder_name, v): v for v in videos}
-            context.user_data[f"file_map_{folder_name}"] = file_map
-            # Отправляем сообщение о начале отправки
-            status_message = await query.message.reply_text(
-                f"Начинаю отправку {len(videos)} видео из папки '{folder_name}'..."
-            )
+        # Сохраняем file_map для этой папки
+        file_map = {get_file_id(folder_name, v): v for v in videos}
+        context.user_data[f"file_map_{folder_name}"] = file_map
+        # Отправляем сообщение о начале отправки
+        status_message = await query.message.reply_text(
+            f"Начинаю отправку {len(videos)} видео из папки '{folder_name}'..."
+        )
+        # Массовая отправка занимает слот в очереди тяжёлых операций
+        user_id = update.effective_user.id
+        status = QueueStatus(query.message, status_message)
+        async with heavy_jobs.slot(user_id, on_position=status.show_position):
             # Отправляем видео по одному
             for i, video in enumerate(videos, 1):
                 try:
-                    video_path = os.path.join(folder_path, video)
-                    with open(video_path, 'rb') as video_file:
-                        await query.message.reply_video(
-                            video=video_file,
-                            caption=f"🎥 {video} ({i}/{len(videos)})"
-                        )
+                    # Квота скорости пользователя в байтах (по file_id ничего не загружается)
+                    if not library.file_id(folder_name, video):
+                        await heavy_jobs.throttle(user_id, await storage.getsize(os.path.join(folder_path, video)))
+                    await send_library_video(query.message, folder_name, video, caption=f"🎥 {video} ({i}/{len(videos)})")
                     # Обновляем статус
                     await status_message.edit_text(
                         f"Отправлено {i} из {len(videos)} видео..."
@@ -789,38 +1229,93 @@ async def folder_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
                         f"Ошибка при отправке видео {video}. Продолжаю отправку..."
                     )
                     continue
-            # Финальное сообщение
-            await status_message.edit_text(
-                f"✅ Все видео из папки '{folder_name}' успешно отправлены!"
-            )
-        except Exception as e:
-            logger.error(f"Ошибка при отправке всех видео: {e}")
-            await query.edit_message_text(
-                "Извините, произошла ошибка при отправке видео."
-            )
-    elif callback_data == "back_to_folders":
-        # Возврат к списку папок
-        await list_folders(update, context)
+        # Финальное сообщение
+        await status_message.edit_text(
+            f"✅ Все видео из папки '{folder_name}' успешно отправлены!"
+        )
+    except Exception as e:
+        logger.error(f"Ошибка при отправке всех видео: {e}")
+        await query.edit_message_text(
+            "Извините, произошла ошибка при отправке видео."
+        )
+
+@callback_router.route("export_", payload=folder_payload)
+async def export_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, folder_name):
+    await export_folder(update.callback_query.message, update.effective_user.id, folder_name)
+
+async def export_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Send a folder as zip volumes: /export <folder>."""
+    if not context.args:
+        folders = await storage.list_folders()
+        if not folders:
+            await update.message.reply_text("Нет доступных папок.")
+            return
+        keyboard = [
+            [InlineKeyboardButton(f"🗜 {folder}", callback_data=safe_callback_data("export", folder))]
+            for folder in folders
+        ]
+        await update.message.reply_text("Выберите папку для экспорта:", reply_markup=InlineKeyboardMarkup(keyboard))
+        return
+    await export_folder(update.message, update.effective_user.id, ' '.join(context.args))
+
+async def export_folder(message, user_id, folder_name):
+    """Stream a folder as stored zip archives split at the document upload limit."""
+    # Только папки библиотеки: имя из команды или callback_data не должно выводить за RESOURCES_DIR
+    if folder_name not in await storage.list_folders():
+        await message.reply_text(f"Папка '{folder_name}' не найдена.")
+        return
+    folder_path = os.path.join(config.RESOURCES_DIR, folder_name)
+    try:
+        volumes, skipped = await zip_export.plan_folder(folder_path, config.EXPORT_VOLUME_MB * 1024 * 1024)
+        if not volumes:
+            await message.reply_text(f"В папке '{folder_name}' нет видео для экспорта.")
+            return
+        status_message = await message.reply_text(
+            f"🗜 Готовлю архив папки '{folder_name}': томов - {len(volumes)}..."
+        )
+        status = QueueStatus(message, status_message)
+        async with heavy_jobs.slot(user_id, on_position=status.show_position):
+            for i, entries in enumerate(volumes, 1):
+                filename = f"{folder_name}.zip" if len(volumes) == 1 else f"{folder_name}.part{i}.zip"
+                await heavy_jobs.throttle(user_id, zip_export.archive_size(entries))
+                await status_message.edit_text(f"🗜 Отправляю том {i} из {len(volumes)} ({len(entries)} видео)...")
+                await zip_export.upload_volume(
+                    message.get_bot(), message.chat_id, filename, entries,
+                    caption=f"🗜 {folder_name} ({i}/{len(volumes)})"
+                )
+        text = f"✅ Папка '{folder_name}' отправлена архивом: томов - {len(volumes)}."
+        if skipped:
+            text += f"\nНе поместились в том ({config.EXPORT_VOLUME_MB} МБ): {', '.join(e.name for e in skipped)}"
+        await status_message.edit_text(text)
+    except Exception as e:
+        logger.error(f"Ошибка при экспорте папки {folder_name}: {e}")
+        await message.reply_text("Извините, произошла ошибка при создании архива.")
+
+@callback_router.route("back_to_folders", exact=True)
+async def back_to_folders_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, payload):
+    # Возврат к списку папок
+    await list_folders(update, context)
+
+async def folder_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Answer the callback query and dispatch it through callback_router."""
+    query = update.callback_query
+    await query.answer()
+    return await callback_router.dispatch(update, context)
 
 async def list_resources(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """List all available video resources."""
     try:
-        folders = [f for f in os.listdir(config.RESOURCES_DIR) 
-                  if os.path.isdir(os.path.join(config.RESOURCES_DIR, f))]
+        folders = await storage.folder_video_sizes()
         
         if not folders:
             await update.message.reply_text("Нет доступных папок с видео.")
             return
         
         message = "Доступные видео по папкам:\n\n"
-        for folder in folders:
-            folder_path = os.path.join(config.RESOURCES_DIR, folder)
-            files = [f for f in os.listdir(folder_path) if f.endswith(('.mp4', '.avi', '.mov'))]
-            
+        for folder, files in folders:
             if files:
                 message += f"📁 {folder}:\n"
-                for i, file in enumerate(files, 1):
-                    file_size = os.path.getsize(os.path.join(folder_path, file))
+                for i, (file, file_size) in enumerate(files, 1):
                     size_mb = round(file_size / (1024 * 1024), 2)
                     message += f"  {i}. {file} ({size_mb} МБ)\n"
                 message += "\n"
@@ -839,6 +1334,24 @@ async def download_from_url(update: Update, context: ContextTypes.DEFAULT_TYPE):
     context.user_data['waiting_for_url'] = True
     return WAITING_URL
 
+def select_youtube_stream(url):
+    """Pick the best progressive MP4 stream of a YouTube video (blocking)."""
+    # Инициализируем YouTube
+    YouTube = get_youtube()
+    yt = YouTube(url)
+    
+    stream = None
+    # Пробуем получить поток с максимальным качеством
+    try:
+        stream = yt.streams.get_highest_resolution()
+    except Exception as e:
+        logger.error(f"Ошибка при выборе качества видео: {e}")
+        
+    if stream == None:
+        # Если не получилось, пробуем получить любой MP4 поток
+        stream = yt.streams.filter(file_extension='mp4').first()
+    return stream
+
 async def handle_url(update: Update, context: ContextTypes.DEFAULT_TYPE):
     url = update.message.text
     user_id = update.effective_user.id
@@ -854,70 +1367,69 @@ async def handle_url(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         # Создаем временное имя файла
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        temp_filename = f"temp_{timestamp}.mp4"
+        temp_filename = make_temp_filename(user_id, timestamp)
         temp_path = os.path.join(config.RESOURCES_DIR, temp_filename)
         
-        # Определяем тип URL и скачиваем видео
-        if 'youtube.com' in url or 'youtu.be' in url:
-            # YouTube
-            await status_message.edit_text("⏳ Загружаю видео с YouTube...")
-            try:
-                # Инициализируем YouTube
-                yt = YouTube(url)
-                
-                stream = None
-                # Пробуем получить поток с максимальным качеством
+        # Скачивание - тяжёлая операция: ждём свою очередь среди других пользователей
+        loop = asyncio.get_running_loop()
+        status = QueueStatus(update.message, status_message)
+        async with heavy_jobs.slot(user_id, on_position=status.show_position):
+            # Определяем тип URL и скачиваем видео
+            if 'youtube.com' in url or 'youtu.be' in url:
+                # YouTube
+                await status_message.edit_text("⏳ Загружаю видео с YouTube...")
                 try:
-                    stream = yt.streams.get_highest_resolution()
-                except Exception as e:
-                    logger.error(f"Ошибка при выборе качества видео: {e}")
-                    
-                if stream == None:
-                    # Если не получилось, пробуем получить любой MP4 поток
-                    stream = yt.streams.filter(file_extension='mp4').first()
-                if not stream:
-                    await status_message.edit_text("❌ Не удалось найти подходящий формат видео.")
-                    return
+                    # pytubefix блокирующий - выбираем поток и скачиваем вне event loop
+                    stream = await loop.run_in_executor(None, select_youtube_stream, url)
+                    if not stream:
+                        await status_message.edit_text("❌ Не удалось найти подходящий формат видео.")
+                        return
                 
-                # Скачиваем видео
-                await status_message.edit_text("⏳ Скачиваю видео...")
-                downloaded_path = stream.download(output_path=config.RESOURCES_DIR, filename=temp_filename)
+                    # Скачиваем видео
+                    await status_message.edit_text("⏳ Скачиваю видео...")
+                    downloaded_path = await loop.run_in_executor(
+                        None, partial(stream.download, output_path=config.RESOURCES_DIR, filename=temp_filename)
+                    )
                 
-                # Проверяем, что файл существует
-                if not os.path.exists(downloaded_path):
-                    await status_message.edit_text("❌ Ошибка при сохранении видео.")
-                    return
+                    # Проверяем, что файл существует
+                    if not await storage.exists(downloaded_path):
+                        await status_message.edit_text("❌ Ошибка при сохранении видео.")
+                        return
                 
-                # Обновляем путь к файлу
-                temp_path = downloaded_path
+                    # Обновляем путь к файлу
+                    temp_path = downloaded_path
                 
-            except Exception as e:
-                logger.error(f"Ошибка при скачивании с YouTube: {e}")
-                await status_message.edit_text(f"❌ Ошибка при скачивании видео с YouTube. {e}")
-                return
+                except Exception as e:
+                    logger.error(f"Ошибка при скачивании с YouTube: {e}")
+                    await status_message.edit_text(f"❌ Ошибка при скачивании видео с YouTube. {e}")
+                    return
             
-        elif 'instagram.com' in url:
-            # Instagram
-            await status_message.edit_text("⏳ Загружаю видео с Instagram...")
-            L = instaloader.Instaloader()
-            post = instaloader.Post.from_shortcode(L.context, url.split('/')[-2])
-            if not post.is_video:
-                await status_message.edit_text("❌ Это не видео.")
-                return
-            L.download_post(post, target=config.RESOURCES_DIR)
-            # Переименовываем скачанный файл
-            downloaded_file = [f for f in os.listdir(config.RESOURCES_DIR) if f.endswith('.mp4')][-1]
-            os.rename(os.path.join(config.RESOURCES_DIR, downloaded_file), temp_path)
+            elif 'instagram.com' in url:
+                # Instagram
+                await status_message.edit_text("⏳ Загружаю видео с Instagram...")
+                try:
+                    # Скачиваем только файл видео - сразу под уникальным временным именем
+                    await loop.run_in_executor(None, instagram_pool.download_video, url, temp_path, MAX_FILE_SIZE)
+                except instagram.NotVideoError:
+                    await status_message.edit_text("❌ Это не видео.")
+                    return
+                except instagram.VideoTooLargeError:
+                    await status_message.edit_text(f"❌ Видео слишком большое. Максимальный размер - {config.MAX_FILE_SIZE_MB} МБ.")
+                    return
+                except (instagram.RateLimitedError, ValueError) as e:
+                    await status_message.edit_text(f"❌ {e}")
+                    return
             
-        else:
-            await status_message.edit_text("❌ Поддерживаются только ссылки на YouTube и Instagram.")
-            return
+            else:
+                await status_message.edit_text("❌ Поддерживаются только ссылки на YouTube и Instagram.")
+                return
         
         # Проверяем размер файла
-        file_size = os.path.getsize(temp_path)
+        file_size = await storage.getsize(temp_path)
+        heavy_jobs.charge(user_id, file_size)
         if file_size > MAX_FILE_SIZE:
-            os.remove(temp_path)
-            await status_message.edit_text("❌ Видео слишком большое. Максимальный размер - 10 МБ.")
+            await storage.remove(temp_path)
+            await status_message.edit_text(f"❌ Видео слишком большое. Максимальный размер - {config.MAX_FILE_SIZE_MB} МБ.")
             return
         
         # Сохраняем информацию о временном файле
@@ -926,13 +1438,11 @@ async def handle_url(update: Update, context: ContextTypes.DEFAULT_TYPE):
             'size': file_size,
             'timestamp': timestamp
         }
+        # Пока пользователь выбирает режим, в фоне готовим превью для обрезки
+        start_preview(user_id, temp_path)
         
         # Показываем меню выбора режима загрузки
-        keyboard = [
-            [InlineKeyboardButton("📤 Загрузить видео полностью", callback_data="upload_full")],
-            [InlineKeyboardButton("✂️ Обрезать видео", callback_data="upload_trim")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        reply_markup = upload_mode_keyboard()
         await status_message.edit_text(
             "✅ Видео успешно загружено!\nВыберите режим загрузки видео:",
             reply_markup=reply_markup
@@ -951,17 +1461,150 @@ async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     context.user_data.clear()
     await update.message.reply_text("Операция отменена. Контекст очищен.")
 
-def main():
-    """Start the bot."""
+async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Start or stop the sampling profiler (admins only).
+
+    /profile [секунды] - профилировать N секунд (по умолчанию 30)
+    /profile updates N - профилировать следующие N обновлений
+    /profile stop - остановить досрочно и получить отчёт
+    """
+    global profile_session
+    if update.effective_user.id not in config.ADMIN_IDS:
+        await update.message.reply_text("Эта команда доступна только администраторам.")
+        return
+
+    args = context.args or []
+    if args and args[0] == "stop":
+        if profile_session is None:
+            await update.message.reply_text("Профилирование не запущено.")
+            return
+        await finish_profiling(context.bot)
+        return
+
+    if profile_session is not None:
+        await update.message.reply_text("Профилирование уже запущено. Используйте /profile stop.")
+        return
+
+    try:
+        if args and args[0] == "updates":
+            max_updates = int(args[1])
+            seconds = config.PROFILE_MAX_SECONDS
+        else:
+            max_updates = None
+            seconds = int(args[0]) if args else 30
+        if seconds <= 0 or (max_updates is not None and max_updates <= 0):
+            raise ValueError
+    except (ValueError, IndexError):
+        await update.message.reply_text("Использование: /profile [секунды] | /profile updates N | /profile stop")
+        return
+    seconds = min(seconds, config.PROFILE_MAX_SECONDS)
+
+    profiler = SamplingProfiler(
+        interval=config.PROFILE_INTERVAL_MS / 1000,
+        block_threshold=config.LOOP_BLOCK_THRESHOLD_MS / 1000
+    )
+    profiler.start()
+    profile_session = {
+        'profiler': profiler,
+        'chat_id': update.effective_chat.id,
+        'max_updates': max_updates,
+        'start_update_id': update.update_id,
+        'callback_timing': callback_timing.snapshot(),
+        'timer': asyncio.create_task(profile_timer(context.bot, seconds)),
+    }
+    if max_updates:
+        await update.message.reply_text(f"🔬 Профилирую следующие {max_updates} обновлений (не дольше {seconds} сек)...")
+    else:
+        await update.message.reply_text(f"🔬 Профилирую {seconds} сек...")
+
+async def profile_timer(bot, seconds):
+    await asyncio.sleep(seconds)
+    await finish_profiling(bot)
+
+async def count_profiled_update(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Count updates processed while profiling; runs after the main handlers."""
+    if profile_session is None or update.update_id == profile_session['start_update_id']:
+        return
+    profiler = profile_session['profiler']
+    profiler.updates += 1
+    max_updates = profile_session['max_updates']
+    if max_updates and profiler.updates >= max_updates:
+        await finish_profiling(context.bot)
+
+async def finish_profiling(bot):
+    """Stop the current profiling session and send the report as a file."""
+    global profile_session
+    session = profile_session
+    if session is None:
+        return
+    profile_session = None
+    if session['timer'] is not asyncio.current_task():
+        session['timer'].cancel()
+
+    profiler = session['profiler']
+    profiler.stop()
+    report = profiler.report(sections=[
+        ("Callback-маршруты: время, вызовы, среднее", callback_timing.report(session['callback_timing'])),
+    ])
+    try:
+        await bot.send_document(
+            chat_id=session['chat_id'],
+            document=io.BytesIO(report.encode('utf-8')),
+            filename=f"profile_{profiler.started_at:%Y%m%d_%H%M%S}.txt",
+            caption=(
+                f"🔬 Сэмплов: {profiler.sample_count}, обновлений: {profiler.updates}, "
+                f"блокировок event loop: {len(profiler.blocks)}"
+            )
+        )
+    except Exception as e:
+        logger.error(f"Ошибка при отправке профиля: {e}")
+
+async def bind_log_context(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    log_pipeline.bind_update(update)
+
+async def on_startup(application: Application):
+    """Log cold-start time and optionally warm up heavy media libraries."""
+    logger.info("Бот готов к работе за %.2f с после запуска", time.perf_counter() - STARTED_AT)
+    if config.WARM_MEDIA_LIBS:
+        warm_up_in_background()
+
+def application_builder(token=None, base_url=None, base_file_url=None, local_mode=None):
+    """ApplicationBuilder with the token, timeouts and Bot API server settings.
+
+    base_url/base_file_url позволяют направить бота на другой Bot API сервер
+    (собственный telegram-bot-api или фейковый сервер из bench/). По умолчанию
+    берутся из config.
+    """
+    base_url = base_url or config.BOT_API_BASE_URL
+    base_file_url = base_file_url or config.BOT_API_BASE_FILE_URL
+    if local_mode is None:
+        local_mode = config.BOT_API_LOCAL_MODE
     # Create the Application with increased connection pool size and timeout
-    application = (
+    builder = (
         Application.builder()
-        .token(config.BOT_TOKEN)
+        .token(token or config.BOT_TOKEN)
         .connection_pool_size(16)  # Увеличиваем размер пула соединений
         .connect_timeout(30.0)     # Увеличиваем таймаут соединения
         .read_timeout(30.0)        # Увеличиваем таймаут чтения
         .write_timeout(30.0)       # Увеличиваем таймаут записи
         .pool_timeout(30.0)        # Увеличиваем таймаут пула
+    )
+    if base_url:
+        builder = builder.base_url(base_url)
+    if base_file_url:
+        builder = builder.base_file_url(base_file_url)
+    if local_mode:
+        builder = builder.local_mode(True)
+    return builder
+
+def build_application(token=None, base_url=None, base_file_url=None, local_mode=None):
+    """Create the Application with all handlers registered."""
+    application = (
+        application_builder(token, base_url, base_file_url, local_mode)
+        .post_init(on_startup)
+        # Параллельная обработка обновлений: пока одни ждут в очереди heavy_jobs,
+        # остальные пользователи обслуживаются
+        .concurrent_updates(config.CONCURRENT_UPDATES)
         .build()
     )
 
@@ -976,6 +1619,8 @@ def main():
     application.add_handler(CommandHandler("clear", clear_chat))
     application.add_handler(CommandHandler("download_from_url", download_from_url))
     application.add_handler(CommandHandler("cancel", cancel))
+    application.add_handler(CommandHandler("export", export_command))
+    application.add_handler(CommandHandler("profile", profile_command))
     
     # Add video handler
     application.add_handler(MessageHandler(filters.VIDEO, handle_video))
@@ -984,7 +1629,29 @@ def main():
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_text))
     
     # Add callback handler for folder selection
-    application.add_handler(CallbackQueryHandler(folder_callback, pattern="^(save_|random_name|delete_|view_|play_|send_all_|back_to_folders|clear_confirm|clear_cancel|select_delete_folder_|delete_video_|cancel_delete_video|finish_delete_video|back_to_folders_delete|custom_name|upload_full|upload_trim)"))
+    application.add_handler(CallbackQueryHandler(folder_callback, pattern=callback_router.pattern()))
+
+    # Счётчик обновлений для профилировщика - после основных обработчиков
+    application.add_handler(TypeHandler(Update, count_profiled_update), group=1)
+
+    # Имя обработчика попадает в контекст логов; ids обновления - ещё до обработчиков
+    for handler in application.handlers[0]:
+        handler.callback = log_pipeline.tag_handler(handler.callback)
+    application.add_handler(TypeHandler(Update, bind_log_context), group=-1)
+
+    return application
+
+def build_front_application():
+    """Application of the front process: only receives updates, handlers run in workers."""
+    return application_builder().build()
+
+def main():
+    """Start the bot."""
+    if config.BOT_WORKERS:
+        # Фронт принимает обновления и раздаёт их воркерам по пользователям
+        cluster.run(build_application, build_front_application)
+        return
+    application = build_application()
 
     # Start the Bot
     application.run_polling(allowed_updates=Update.ALL_TYPES)
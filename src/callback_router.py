@@ -0,0 +1,188 @@
+import re
+import time
+import logging
+from collections import defaultdict
+
+logger = logging.getLogger(__name__)
+
+
+class Route:
+    """A registered callback route: prefix, handler, payload decoder and middleware."""
+
+    def __init__(self, prefix, handler, exact=False, payload=str, middleware=()):
+        self.prefix = prefix
+        self.handler = handler
+        self.exact = exact
+        self.payload = payload
+        self.middleware = list(middleware)
+
+    @property
+    def name(self):
+        return self.prefix if self.exact else self.prefix + "*"
+
+    def decode(self, raw):
+        """Convert the part of callback_data after the prefix into the handler argument."""
+        if self.exact or self.payload is None:
+            return None
+        return self.payload(raw)
+
+
+class _Node:
+    __slots__ = ("children", "exact", "prefix")
+
+    def __init__(self):
+        self.children = {}
+        self.exact = None
+        self.prefix = None
+
+
+class CallbackRouter:
+    """Prefix-trie router for inline keyboard callback_data.
+
+    Маршрут регистрируется по префиксу (или точному значению, exact=True).
+    При разборе выбирается самый длинный подходящий префикс, поэтому
+    порядок регистрации не важен: "delete_folder_" сработает раньше "delete_".
+    Обработчик вызывается как handler(update, context, payload), где payload -
+    остаток callback_data после префикса, преобразованный функцией `payload`.
+
+    Middleware - корутина mw(route, update, context, call_next); общие
+    (router.use) выполняются до маршрутных.
+    """
+
+    def __init__(self):
+        self._root = _Node()
+        self._routes = []
+        self._middleware = []
+
+    def use(self, middleware):
+        """Add a middleware applied to every route."""
+        self._middleware.append(middleware)
+        return middleware
+
+    def add_route(self, prefix, handler, exact=False, payload=str, middleware=()):
+        node = self._root
+        for char in prefix:
+            node = node.children.setdefault(char, _Node())
+        route = Route(prefix, handler, exact=exact, payload=payload, middleware=middleware)
+        if exact:
+            if node.exact is not None:
+                raise ValueError(f"Callback route '{prefix}' is already registered")
+            node.exact = route
+        else:
+            if node.prefix is not None:
+                raise ValueError(f"Callback route '{prefix}*' is already registered")
+            node.prefix = route
+        self._routes.append(route)
+        return route
+
+    def route(self, prefix, exact=False, payload=str, middleware=()):
+        """Decorator form of add_route."""
+        def decorator(handler):
+            self.add_route(prefix, handler, exact=exact, payload=payload, middleware=middleware)
+            return handler
+        return decorator
+
+    @property
+    def routes(self):
+        return list(self._routes)
+
+    def match(self, data):
+        """Return (route, raw payload) for callback_data, or (None, None)."""
+        node = self._root
+        best = None
+        best_len = 0
+        for i, char in enumerate(data):
+            if node.prefix is not None:
+                best, best_len = node.prefix, i
+            node = node.children.get(char)
+            if node is None:
+                break
+        else:
+            if node.exact is not None:
+                return node.exact, ""
+            if node.prefix is not None:
+                best, best_len = node.prefix, len(data)
+        if best is None:
+            return None, None
+        return best, data[best_len:]
+
+    def pattern(self):
+        """Regex for CallbackQueryHandler that accepts exactly the registered routes."""
+        parts = []
+        for route in sorted(self._routes, key=lambda r: len(r.prefix), reverse=True):
+            parts.append(re.escape(route.prefix) + ("$" if route.exact else ""))
+        return "^(?:" + "|".join(parts) + ")"
+
+    async def dispatch(self, update, context):
+        data = update.callback_query.data or ""
+        route, raw = self.match(data)
+        if route is None:
+            logger.warning(f"Неизвестный callback_data: {data}")
+            return None
+        try:
+            payload = route.decode(raw)
+        except ValueError as e:
+            logger.warning(f"Некорректные данные для маршрута {route.name}: {data} ({e})")
+            return None
+
+        async def call_handler(update, context):
+            return await route.handler(update, context, payload)
+
+        chain = call_handler
+        for middleware in reversed(self._middleware + route.middleware):
+            chain = _bind(middleware, route, chain)
+        return await chain(update, context)
+
+
+def _bind(middleware, route, call_next):
+    async def wrapper(update, context):
+        return await middleware(route, update, context, call_next)
+    return wrapper
+
+
+class TimingMiddleware:
+    """Collects per-route call counts and total handler time."""
+
+    def __init__(self, slow_threshold=1.0):
+        self.slow_threshold = slow_threshold
+        self.calls = defaultdict(int)
+        self.total_time = defaultdict(float)
+
+    async def __call__(self, route, update, context, call_next):
+        started = time.perf_counter()
+        try:
+            return await call_next(update, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.calls[route.name] += 1
+            self.total_time[route.name] += elapsed
+            if elapsed >= self.slow_threshold:
+                logger.warning(f"Медленный callback {route.name}: {elapsed:.2f} с")
+
+    def snapshot(self):
+        """Copy of the counters, to report only the calls made after this point."""
+        return dict(self.calls), dict(self.total_time)
+
+    def report(self, since=None):
+        """Lines "route: calls, total and mean time", slowest routes first."""
+        calls, total_time = since or ({}, {})
+        rows = []
+        for name, count in self.calls.items():
+            count -= calls.get(name, 0)
+            if count > 0:
+                rows.append((self.total_time[name] - total_time.get(name, 0.0), count, name))
+        rows.sort(reverse=True)
+        return [
+            f"{total * 1000:10.1f} мс  {count:6d}  {total / count * 1000:8.1f} мс/вызов  {name}"
+            for total, count, name in rows
+        ]
+
+
+def allow_users(user_ids, message="Недостаточно прав."):
+    """Middleware factory: only users from `user_ids` may trigger the route."""
+    async def middleware(route, update, context, call_next):
+        if update.effective_user.id not in user_ids:
+            await update.callback_query.edit_message_text(message)
+            return None
+        return await call_next(update, context)
+    return middleware
@@ -0,0 +1,117 @@
+import json
+import signal
+import asyncio
+import logging
+import multiprocessing
+from functools import partial
+from telegram import Update
+from telegram.ext import ApplicationHandlerStop, TypeHandler
+import config
+import storage
+from state_store import StateStore
+
+logger = logging.getLogger(__name__)
+
+
+def shard_for(update, workers):
+    """Worker index for an update: all updates of one user go to the same worker.
+
+    Так у пользователя сохраняется порядок обновлений, а user_data и
+    состояние диалога остаются в одном процессе.
+    """
+    if update.effective_user:
+        key = update.effective_user.id
+    elif update.effective_chat:
+        key = update.effective_chat.id
+    else:
+        key = 0
+    return key % workers
+
+
+async def _forward(store, workers, update, context):
+    payload = json.dumps(update.to_dict(), ensure_ascii=False)
+    await storage.run(store.push_update, shard_for(update, workers), payload)
+    raise ApplicationHandlerStop
+
+
+def run_front(application, store, workers):
+    """Receive updates (polling or webhook) and queue them for the workers."""
+    # Обновления записываются в очередь по одному - порядок внутри шарда сохраняется
+    application.add_handler(TypeHandler(Update, partial(_forward, store, workers)))
+    logger.info("Фронт запущен, воркеров: %s", workers)
+    if config.WEBHOOK_URL:
+        # Нужен python-telegram-bot[webhooks]
+        application.run_webhook(
+            listen=config.WEBHOOK_LISTEN,
+            port=config.WEBHOOK_PORT,
+            url_path=config.WEBHOOK_PATH,
+            webhook_url=config.WEBHOOK_URL,
+            secret_token=config.WEBHOOK_SECRET or None,
+            allowed_updates=Update.ALL_TYPES,
+        )
+    else:
+        application.run_polling(allowed_updates=Update.ALL_TYPES)
+
+
+async def _pump(application, store, shard):
+    """Move queued updates of this worker's shard into the application."""
+    idle = config.WORKER_POLL_MS / 1000
+    while True:
+        try:
+            payloads = await storage.run(store.pop_updates, shard)
+        except Exception as e:
+            logger.error(f"Ошибка чтения очереди обновлений: {e}")
+            payloads = []
+        for payload in payloads:
+            await application.update_queue.put(Update.de_json(json.loads(payload), application.bot))
+        if not payloads:
+            await asyncio.sleep(idle)
+
+
+async def _serve(application, store, shard):
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    async with application:
+        # post_init вызывается только из run_polling/run_webhook
+        if application.post_init:
+            await application.post_init(application)
+        await application.start()
+        pump = asyncio.create_task(_pump(application, store, shard))
+        try:
+            await stop.wait()
+        finally:
+            pump.cancel()
+            await application.stop()
+
+
+def run_worker(build_application, index):
+    """Process updates of shard `index` with a full bot application (no polling)."""
+    store = StateStore(config.STATE_DB_PATH)
+    logger.info("Воркер %s запущен", index)
+    asyncio.run(_serve(build_application(), store, index))
+    logger.info("Воркер %s остановлен", index)
+
+
+def run(build_application, build_front_application):
+    """Start the configured role: front, worker or both (front + BOT_WORKERS processes)."""
+    if config.BOT_ROLE == 'worker':
+        run_worker(build_application, config.BOT_WORKER_INDEX)
+        return
+    store = StateStore(config.STATE_DB_PATH)
+    processes = []
+    if config.BOT_ROLE == 'all':
+        # spawn - воркеры не наследуют потоки и соединения SQLite родителя
+        context = multiprocessing.get_context('spawn')
+        for index in range(config.BOT_WORKERS):
+            process = context.Process(target=run_worker, args=(build_application, index), name=f"worker-{index}")
+            process.start()
+            processes.append(process)
+    try:
+        run_front(build_front_application(), store, config.BOT_WORKERS)
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.join()
@@ -11,4 +11,109 @@ BOT_TOKEN = os.getenv('BOT_TOKEN')
 RESOURCES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "resources")
 
 # Ensure resources directory exists
-os.makedirs(RESOURCES_DIR, exist_ok=True) 
\ No newline at end of file
+os.makedirs(RESOURCES_DIR, exist_ok=True)
+
+# Telegram ID администраторов через запятую (доступ к /profile)
+ADMIN_IDS = {int(x) for x in os.getenv('ADMIN_IDS', '').split(',') if x.strip()}
+# Telegram ID пользователей, которым разрешено удалять папки и видео (пусто - всем)
+DELETE_USER_IDS = {int(x) for x in os.getenv('DELETE_USER_IDS', '').split(',') if x.strip()}
+
+# Профилировщик: интервал сэмплирования и порог блокировки event loop (мс)
+PROFILE_INTERVAL_MS = float(os.getenv('PROFILE_INTERVAL_MS', '5'))
+LOOP_BLOCK_THRESHOLD_MS = float(os.getenv('LOOP_BLOCK_THRESHOLD_MS', '200'))
+# Максимальная длительность сессии профилирования (сек)
+PROFILE_MAX_SECONDS = int(os.getenv('PROFILE_MAX_SECONDS', '600'))
+
+# Загружать moviepy/pytubefix/instaloader в фоне сразу после старта. По умолчанию
+# выключено: moviepy.editor с numpy занимает память, даже если обрезок нет, а при
+# первом использовании модули импортируются вне event loop
+WARM_MEDIA_LIBS = os.getenv('WARM_MEDIA_LIBS', '0') == '1'
+
+# Потоков в пуле файловых операций (rename, rmtree, listdir)
+STORAGE_THREADS = int(os.getenv('STORAGE_THREADS', '4'))
+
+# Собственный Bot API сервер (telegram-bot-api). Пусто - облачный api.telegram.org
+BOT_API_BASE_URL = os.getenv('BOT_API_BASE_URL', '')
+BOT_API_BASE_FILE_URL = os.getenv('BOT_API_BASE_FILE_URL', '')
+# Сервер запущен с --local: файлы передаются путями, лимиты Telegram снимаются
+BOT_API_LOCAL_MODE = os.getenv('BOT_API_LOCAL_MODE', '0') == '1'
+
+# Максимальный размер видео (МБ): 10 для облачного API, до 2000 для локального сервера
+MAX_FILE_SIZE_MB = int(os.getenv('MAX_FILE_SIZE_MB') or ('2000' if BOT_API_LOCAL_MODE else '10'))
+
+# Максимальный размер тома zip-архива при экспорте папки (МБ): лимит отправки
+# документов ботом - 50 для облачного API, 2000 для локального сервера
+EXPORT_VOLUME_MB = int(os.getenv('EXPORT_VOLUME_MB') or ('2000' if BOT_API_LOCAL_MODE else '50'))
+
+# Сколько обновлений обрабатывать параллельно
+CONCURRENT_UPDATES = int(os.getenv('CONCURRENT_UPDATES', '16'))
+
+# Тяжёлые операции (обрезка, скачивание, отправка папки): всего и на пользователя
+HEAVY_JOBS_CONCURRENCY = int(os.getenv('HEAVY_JOBS_CONCURRENCY', '2'))
+HEAVY_JOBS_PER_USER = int(os.getenv('HEAVY_JOBS_PER_USER', '1'))
+# Квота скорости на пользователя, КБ/с (0 - без ограничения)
+USER_BYTE_RATE_KB = int(os.getenv('USER_BYTE_RATE_KB', '0'))
+# Веса пользователей в очереди: "id:вес,id:вес"
+USER_WEIGHTS = {
+    int(user_id): int(weight)
+    for user_id, weight in (item.split(':') for item in os.getenv('USER_WEIGHTS', '').split(',') if item.strip())
+}
+
+# Квота диска для библиотеки видео, МБ (0 - без ограничения)
+DISK_QUOTA_MB = int(os.getenv('DISK_QUOTA_MB', '0'))
+# Битрейт "холодных" копий давно не просматривавшихся видео (пусто - не пережимать)
+COLD_BITRATE = os.getenv('COLD_BITRATE', '500k')
+# Файл индекса библиотеки (время доступа, file_id Telegram) в RESOURCES_DIR
+LIBRARY_INDEX_NAME = '.library.json'
+
+# Максимум фрагментов при нарезке видео на части
+MAX_TRIM_SEGMENTS = int(os.getenv('MAX_TRIM_SEGMENTS', '20'))
+
+# Альбомы: пауза после последнего видео (сек) и число параллельных загрузок
+ALBUM_COLLECT_DELAY = float(os.getenv('ALBUM_COLLECT_DELAY', '1.5'))
+ALBUM_DOWNLOAD_CONCURRENCY = int(os.getenv('ALBUM_DOWNLOAD_CONCURRENCY', '4'))
+
+# Превью ключевых кадров перед обрезкой: число кадров (0 - выключено), ширина кадра,
+# число потоков и сколько секунд ждать готовности превью
+PREVIEW_FRAMES = int(os.getenv('PREVIEW_FRAMES', '16'))
+PREVIEW_WIDTH = int(os.getenv('PREVIEW_WIDTH', '240'))
+PREVIEW_THREADS = int(os.getenv('PREVIEW_THREADS', '1'))
+PREVIEW_WAIT_SECONDS = float(os.getenv('PREVIEW_WAIT_SECONDS', '10'))
+
+# Несколько процессов: фронт принимает обновления и раздаёт их BOT_WORKERS воркерам
+# (0 - всё в одном процессе). BOT_ROLE: all - фронт и воркеры в одном контейнере,
+# front/worker - отдельные контейнеры (для воркера задаётся BOT_WORKER_INDEX)
+BOT_WORKERS = int(os.getenv('BOT_WORKERS', '0'))
+BOT_ROLE = os.getenv('BOT_ROLE', 'all')
+BOT_WORKER_INDEX = int(os.getenv('BOT_WORKER_INDEX', '0'))
+# Общее состояние процессов (SQLite в режиме WAL): том должен быть на одном хосте
+STATE_DB_PATH = os.getenv('STATE_DB_PATH') or os.path.join(RESOURCES_DIR, '.state.db')
+# Как часто воркер проверяет очередь обновлений, когда она пуста (мс)
+WORKER_POLL_MS = int(os.getenv('WORKER_POLL_MS', '50'))
+
+# Webhook для фронта (пусто - long polling)
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '')
+WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8443'))
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', '')
+
+# Instagram: число анонимных сессий или логины с сохранёнными сессиями
+# (instaloader --login <логин>), каталог файлов сессий (пусто - по умолчанию instaloader)
+INSTAGRAM_POOL_SIZE = int(os.getenv('INSTAGRAM_POOL_SIZE', '1'))
+INSTAGRAM_USERNAMES = [x.strip() for x in os.getenv('INSTAGRAM_USERNAMES', '').split(',') if x.strip()]
+INSTAGRAM_SESSION_DIR = os.getenv('INSTAGRAM_SESSION_DIR', '')
+# Пауза сессии после 429 (сек, удваивается при повторах) и сколько ждать свободную сессию
+INSTAGRAM_BACKOFF_SECONDS = float(os.getenv('INSTAGRAM_BACKOFF_SECONDS', '60'))
+INSTAGRAM_MAX_BACKOFF_SECONDS = float(os.getenv('INSTAGRAM_MAX_BACKOFF_SECONDS', '1800'))
+INSTAGRAM_MAX_WAIT_SECONDS = float(os.getenv('INSTAGRAM_MAX_WAIT_SECONDS', '30'))
+
+# Логи: уровень, формат (json или text), размер очереди записей и прореживание
+# шумных логгеров ниже WARNING ("логгер:доля,..." - 0.1 оставляет каждую десятую запись)
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'json')
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', '10000'))
+LOG_SAMPLING = {
+    name.strip(): float(rate)
+    for name, rate in (item.rsplit(':', 1) for item in os.getenv('LOG_SAMPLING', 'httpx:0.1').split(',') if ':' in item)
+}
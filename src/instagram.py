@@ -0,0 +1,204 @@
+import os
+import re
+import time
+import logging
+import threading
+from lazy_imports import get_instaloader
+
+logger = logging.getLogger(__name__)
+
+# Размер блока при скачивании видео
+CHUNK_SIZE = 1024 * 1024
+
+_SHORTCODE_RE = re.compile(r'instagram\.com/(?:[\w.]+/)?(?:p|reel|reels|tv)/([\w-]+)')
+
+
+class NotVideoError(Exception):
+    """The post has no video."""
+
+
+class VideoTooLargeError(Exception):
+    """The video is larger than the allowed size."""
+
+
+class RateLimitedError(Exception):
+    """Every session is cooling down after Instagram's rate limit."""
+
+
+def parse_shortcode(url):
+    """Shortcode of a post/reel URL; ValueError if the URL isn't one."""
+    match = _SHORTCODE_RE.search(url)
+    if not match:
+        raise ValueError("Не удалось найти публикацию в ссылке.")
+    return match.group(1)
+
+
+def _is_rate_limited(error):
+    instaloader = get_instaloader()
+    return (
+        isinstance(error, instaloader.TooManyRequestsException)
+        or isinstance(error.__cause__, instaloader.TooManyRequestsException)
+    )
+
+
+class _Session:
+    __slots__ = ("loader", "name", "busy", "failures", "cooldown_until")
+
+    def __init__(self, loader, name):
+        self.loader = loader
+        self.name = name
+        self.busy = False
+        self.failures = 0
+        self.cooldown_until = 0.0
+
+
+class InstagramPool:
+    """Long-lived Instaloader sessions shared by all downloads (blocking API).
+
+    Экземпляры Instaloader живут всё время работы бота: так сохраняются
+    cookies и собственный учёт частоты запросов instaloader. Получив 429,
+    сессия уходит на паузу с экспоненциально растущей длительностью,
+    а запрос повторяется на другой свободной сессии.
+    """
+
+    def __init__(self, size=1, usernames=(), session_dir=None, backoff=60.0, max_backoff=1800.0, max_wait=30.0):
+        self.size = size
+        self.usernames = list(usernames)
+        self.session_dir = session_dir
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_wait = max_wait
+        self._sessions = None
+        self._condition = threading.Condition()
+
+    def _create_sessions(self):
+        instaloader = get_instaloader()
+
+        def make_loader():
+            return instaloader.Instaloader(
+                quiet=True,
+                download_pictures=False,
+                download_videos=False,
+                download_video_thumbnails=False,
+                download_geotags=False,
+                download_comments=False,
+                save_metadata=False,
+                compress_json=False,
+                # 429 обрабатываем сами, а не спим внутри instaloader
+                max_connection_attempts=1,
+            )
+
+        sessions = []
+        for username in self.usernames:
+            loader = make_loader()
+            try:
+                filename = os.path.join(self.session_dir, f"session-{username}") if self.session_dir else None
+                loader.load_session_from_file(username, filename)
+                sessions.append(_Session(loader, username))
+            except Exception as e:
+                logger.error(f"Не удалось загрузить сессию Instagram {username}: {e}")
+        # Без сохранённых сессий - анонимные клиенты
+        while len(sessions) < max(self.size, 1) and not self.usernames:
+            sessions.append(_Session(make_loader(), f"anonymous-{len(sessions) + 1}"))
+        if not sessions:
+            sessions.append(_Session(make_loader(), "anonymous"))
+        return sessions
+
+    def _ensure_sessions(self):
+        with self._condition:
+            if self._sessions is None:
+                self._sessions = self._create_sessions()
+            return self._sessions
+
+    def _acquire(self):
+        deadline = time.monotonic() + self.max_wait
+        with self._condition:
+            while True:
+                now = time.time()
+                free = [s for s in self._sessions if not s.busy]
+                ready = [s for s in free if s.cooldown_until <= now]
+                if ready:
+                    session = min(ready, key=lambda s: s.failures)
+                    session.busy = True
+                    return session
+                remaining = deadline - time.monotonic()
+                # Все сессии на паузе дольше, чем можно ждать, - сразу сообщаем пользователю
+                all_paused = len(free) == len(self._sessions)
+                if remaining <= 0 or (all_paused and min(s.cooldown_until for s in free) - now > remaining):
+                    raise RateLimitedError("Instagram ограничил частоту запросов, попробуйте позже.")
+                self._condition.wait(min([s.cooldown_until - now for s in free] + [remaining]))
+
+    def _release(self, session, rate_limited=False):
+        with self._condition:
+            session.busy = False
+            if rate_limited:
+                session.failures += 1
+                pause = min(self.backoff * 2 ** (session.failures - 1), self.max_backoff)
+                session.cooldown_until = time.time() + pause
+                logger.warning(f"Instagram: сессия {session.name} на паузе {pause:.0f} с после 429")
+            else:
+                session.failures = 0
+            self._condition.notify_all()
+
+    def _call(self, func):
+        """Run func(loader) on a free session, moving to another one on 429."""
+        attempts = len(self._ensure_sessions())
+        for attempt in range(attempts):
+            session = self._acquire()
+            try:
+                result = func(session.loader)
+            except Exception as e:
+                rate_limited = _is_rate_limited(e)
+                self._release(session, rate_limited)
+                if rate_limited and attempt + 1 < attempts:
+                    continue
+                if rate_limited:
+                    raise RateLimitedError("Instagram ограничил частоту запросов, попробуйте позже.") from e
+                raise
+            self._release(session)
+            return result
+
+    def video_url(self, url):
+        """Direct URL of the post's video; NotVideoError for photo posts."""
+        instaloader = get_instaloader()
+        shortcode = parse_shortcode(url)
+
+        def fetch(loader):
+            post = instaloader.Post.from_shortcode(loader.context, shortcode)
+            if not post.is_video:
+                raise NotVideoError()
+            return post.video_url
+
+        return self._call(fetch)
+
+    def download_video(self, url, dest_path, max_size=None):
+        """Stream the post's video into dest_path; returns its size in bytes.
+
+        Скачивается только файл видео, без картинок, подписей и json.
+        При превышении max_size загрузка прерывается (VideoTooLargeError).
+        """
+        video_url = self.video_url(url)
+
+        def stream(loader):
+            response = loader.context.get_raw(video_url)
+            try:
+                length = int(response.headers.get('Content-Length') or 0)
+                if max_size and length > max_size:
+                    raise VideoTooLargeError()
+                size = 0
+                with open(dest_path, 'wb') as f:
+                    for chunk in response.iter_content(CHUNK_SIZE):
+                        size += len(chunk)
+                        if max_size and size > max_size:
+                            raise VideoTooLargeError()
+                        f.write(chunk)
+                return size
+            finally:
+                response.close()
+
+        try:
+            return self._call(stream)
+        except Exception:
+            if os.path.exists(dest_path):
+                os.remove(dest_path)
+            raise
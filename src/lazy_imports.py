@@ -0,0 +1,53 @@
+import time
+import logging
+import importlib
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Тяжёлые библиотеки: moviepy.editor тянет numpy, imageio, PIL и т.д.
+HEAVY_MODULES = ("moviepy.editor", "pytubefix", "instaloader")
+
+# Время импорта каждого модуля (сек)
+import_times = {}
+
+
+def load(name):
+    """Import a module on first use and remember how long it took."""
+    if name in import_times:
+        return importlib.import_module(name)
+    # importlib сам защищает модуль от параллельного импорта из разных потоков
+    started = time.perf_counter()
+    module = importlib.import_module(name)
+    if name not in import_times:
+        import_times[name] = time.perf_counter() - started
+        logger.info("Модуль %s загружен за %.2f с", name, import_times[name])
+    return module
+
+
+def get_video_file_clip():
+    return load("moviepy.editor").VideoFileClip
+
+
+def get_youtube():
+    return load("pytubefix").YouTube
+
+
+def get_instaloader():
+    return load("instaloader")
+
+
+def warm_up(names=HEAVY_MODULES):
+    """Import heavy modules in order; errors are logged, not raised."""
+    for name in names:
+        try:
+            load(name)
+        except Exception as e:
+            logger.error(f"Не удалось загрузить модуль {name}: {e}")
+
+
+def warm_up_in_background(names=HEAVY_MODULES):
+    """Start warm_up() in a daemon thread so the first trim/download doesn't pay the import."""
+    thread = threading.Thread(target=warm_up, args=(names,), name="warm-up", daemon=True)
+    thread.start()
+    return thread
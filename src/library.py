@@ -0,0 +1,237 @@
+import os
+import json
+import time
+import shutil
+import asyncio
+import logging
+import tempfile
+import config
+import storage
+from lazy_imports import get_video_file_clip
+
+logger = logging.getLogger(__name__)
+
+HOT = 'hot'
+COLD = 'cold'
+EVICTED = 'evicted'
+
+
+def _reencode(path, bitrate):
+    """Re-encode a video in place at a lower bitrate (blocking); returns the new size."""
+    VideoFileClip = get_video_file_clip()
+    # Пишем во временный каталог, чтобы недописанный файл не попал в список видео
+    tmp_dir = tempfile.mkdtemp(prefix="cold_")
+    tmp_path = os.path.join(tmp_dir, os.path.basename(path))
+    try:
+        clip = VideoFileClip(path)
+        try:
+            clip.write_videofile(tmp_path, bitrate=bitrate, audio_bitrate='64k', logger=None)
+        finally:
+            clip.close()
+        if os.path.getsize(tmp_path) < os.path.getsize(path):
+            shutil.move(tmp_path, path)
+        return os.path.getsize(path)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def _scan(root):
+    """{(folder, name): (size, mtime)} for every video in the library."""
+    result = {}
+    for folder in storage._list_folders(root):
+        folder_path = os.path.join(root, folder)
+        for name in storage._list_videos(folder_path):
+            st = os.stat(os.path.join(folder_path, name))
+            result[(folder, name)] = (st.st_size, st.st_mtime)
+    return result
+
+
+def _write_index(index_path, data):
+    tmp_path = index_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(data)
+    os.replace(tmp_path, index_path)
+
+
+class Library:
+    """Access tracking, Telegram file_id cache and disk quota for the video library.
+
+    Индекс хранится в JSON рядом с папками ресурсов. При превышении квоты
+    давно не просматривавшиеся видео сначала пережимаются с низким битрейтом
+    (холодный уровень), а затем, если у них есть сохранённый file_id Telegram,
+    удаляются с диска - такие видео по-прежнему отправляются по file_id.
+
+    С общим хранилищем (store) индекс лежит в SQLite, перечитывается при
+    каждом load() и сохраняется по изменённым полям записей, чтобы процессы
+    не затирали изменения друг друга.
+    """
+
+    def __init__(self, quota_bytes=0, cold_bitrate=None, low_watermark=0.9, store=None):
+        self.quota_bytes = quota_bytes
+        self.cold_bitrate = cold_bitrate
+        self.low_watermark = low_watermark
+        self.store = store
+        self.entries = {}
+        # {ключ: {поле: значение}} - ещё не сохранённые изменения
+        self._dirty = {}
+        self._enforcing = False
+        self._loaded = False
+
+    @property
+    def root(self):
+        return config.RESOURCES_DIR
+
+    @property
+    def index_path(self):
+        return os.path.join(self.root, config.LIBRARY_INDEX_NAME)
+
+    @staticmethod
+    def _key(folder, name):
+        return f"{folder}/{name}"
+
+    async def load(self):
+        if self.store is not None:
+            fresh = dict(await storage.run(self.store.items, 'library'))
+            # Обновляем словари на месте: ссылки на записи остаются действительными
+            for key in list(self.entries):
+                if key not in fresh:
+                    del self.entries[key]
+            for key, value in fresh.items():
+                value.update(self._dirty.get(key, {}))
+                entry = self.entries.setdefault(key, {})
+                entry.clear()
+                entry.update(value)
+            return
+        if self._loaded:
+            return
+        self._loaded = True
+        try:
+            def _read(path):
+                with open(path, encoding='utf-8') as f:
+                    return json.load(f)
+            self.entries = await storage.run(_read, self.index_path)
+        except FileNotFoundError:
+            self.entries = {}
+        except Exception as e:
+            logger.error(f"Не удалось прочитать индекс библиотеки: {e}")
+            self.entries = {}
+
+    async def save(self):
+        if self.store is not None:
+            dirty, self._dirty = self._dirty, {}
+            if dirty:
+                await storage.run(self.store.update_many, 'library', dirty)
+            return
+        self._dirty = {}
+        data = json.dumps(self.entries, ensure_ascii=False)
+        await storage.run(_write_index, self.index_path, data)
+
+    async def _delete(self, keys):
+        if self.store is not None:
+            await storage.run(self.store.delete_many, 'library', keys)
+        else:
+            await self.save()
+
+    def entry(self, folder, name):
+        return self.entries.get(self._key(folder, name))
+
+    def _update(self, folder, name, **fields):
+        """Change fields of an entry; they are written by the next save()."""
+        key = self._key(folder, name)
+        self.entries.setdefault(key, {}).update(fields)
+        self._dirty.setdefault(key, {}).update(fields)
+
+    async def record_access(self, folder, name, file_id=None):
+        """Record that a video was sent, remembering its Telegram file_id."""
+        await self.load()
+        fields = {'last_access': time.time()}
+        if file_id:
+            fields['file_id'] = file_id
+        self._update(folder, name, **fields)
+        await self.save()
+
+    def file_id(self, folder, name):
+        entry = self.entry(folder, name)
+        return entry.get('file_id') if entry else None
+
+    async def evicted(self, folder):
+        """Videos of a folder that are no longer on disk but can be sent by file_id."""
+        await self.load()
+        prefix = folder + '/'
+        return [
+            key[len(prefix):] for key, entry in self.entries.items()
+            if key.startswith(prefix) and entry.get('tier') == EVICTED
+        ]
+
+    async def forget(self, folder, name):
+        await self.load()
+        key = self._key(folder, name)
+        self._dirty.pop(key, None)
+        if self.entries.pop(key, None) is not None:
+            await self._delete([key])
+
+    async def forget_folder(self, folder):
+        await self.load()
+        prefix = folder + '/'
+        keys = [key for key in self.entries if key.startswith(prefix)]
+        for key in keys:
+            del self.entries[key]
+            self._dirty.pop(key, None)
+        if keys:
+            await self._delete(keys)
+
+    async def enforce_quota(self):
+        """Bring disk usage under the quota: compress, then evict least recently used videos."""
+        if not self.quota_bytes or self._enforcing:
+            return
+        # С несколькими процессами квоту проверяет только один из них
+        owner = str(os.getpid())
+        if self.store is not None and not await storage.run(self.store.acquire_lease, 'enforce_quota', owner, 3600):
+            return
+        self._enforcing = True
+        try:
+            await self.load()
+            files = await storage.run(_scan, self.root)
+            usage = sum(size for size, _ in files.values())
+            if usage <= self.quota_bytes:
+                return
+            target = self.quota_bytes * self.low_watermark
+            logger.info("Превышена квота диска: %.1f из %.1f МБ", usage / 2**20, self.quota_bytes / 2**20)
+
+            def last_access(item):
+                (folder, name), (size, mtime) = item
+                entry = self.entry(folder, name) or {}
+                return entry.get('last_access', mtime)
+
+            candidates = sorted(files.items(), key=last_access)
+            loop = asyncio.get_running_loop()
+            # Первый проход - пережимаем, второй - удаляем то, что можно отдать по file_id
+            for stage in (COLD, EVICTED):
+                for (folder, name), (size, _) in candidates:
+                    if usage <= target:
+                        break
+                    # Запись перечитывается после каждого await - её могли изменить другие обновления
+                    entry = self.entry(folder, name) or {}
+                    path = os.path.join(self.root, folder, name)
+                    try:
+                        if stage == COLD and entry.get('tier', HOT) == HOT and self.cold_bitrate:
+                            new_size = await loop.run_in_executor(None, _reencode, path, self.cold_bitrate)
+                            self._update(folder, name, tier=COLD)
+                            usage -= size - new_size
+                            files[(folder, name)] = (new_size, 0)
+                            logger.info("Видео %s/%s перенесено в холодное хранилище", folder, name)
+                        elif stage == EVICTED and entry.get('file_id'):
+                            size = files[(folder, name)][0]
+                            await storage.remove(path)
+                            self._update(folder, name, tier=EVICTED)
+                            usage -= size
+                            logger.info("Видео %s/%s удалено с диска, доступно по file_id", folder, name)
+                    except Exception as e:
+                        logger.error(f"Ошибка при освобождении места ({folder}/{name}): {e}")
+                    await self.save()
+            if usage > self.quota_bytes:
+                logger.warning(f"Не удалось уложиться в квоту диска: {usage / 2**20:.1f} МБ")
+        finally:
+            self._enforcing = False
+            if self.store is not None:
+                await storage.run(self.store.release_lease, 'enforce_quota', owner)
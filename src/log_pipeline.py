@@ -0,0 +1,205 @@
+import sys
+import json
+import time
+import queue
+import atexit
+import random
+import logging
+import threading
+import functools
+import contextvars
+
+# Поля контекста (update_id, chat_id, user_id, handler) текущего обновления.
+# Задачи asyncio копируют контекст, поэтому фоновые задачи обработчика его наследуют.
+log_context = contextvars.ContextVar("log_context", default=None)
+
+# Сколько записей писать за один системный вызов
+BATCH_SIZE = 500
+
+_STOP = object()
+
+
+def bind(**fields):
+    """Add fields to the log context of the current task."""
+    context = dict(log_context.get() or {})
+    context.update(fields)
+    log_context.set(context)
+
+
+def bind_update(update):
+    """Reset the log context to the ids of an incoming update."""
+    context = {"update_id": update.update_id}
+    if update.effective_chat:
+        context["chat_id"] = update.effective_chat.id
+    if update.effective_user:
+        context["user_id"] = update.effective_user.id
+    log_context.set(context)
+
+
+def tag_handler(callback):
+    """Wrap a PTB handler callback so log records carry its name."""
+    name = callback.__name__
+
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        bind(handler=name)
+        return await callback(update, context)
+    return wrapper
+
+
+async def log_context_middleware(route, update, context, call_next):
+    """CallbackRouter middleware: the route name becomes the handler in the log context."""
+    bind(handler=route.name)
+    return await call_next(update, context)
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, message, context and traceback."""
+
+    def format(self, record):
+        data = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        if record.log_context:
+            data.update(record.log_context)
+        if record.exc_info:
+            data["exc"] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """The bot's classic text format, with the context appended."""
+
+    def __init__(self):
+        super().__init__('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    def format(self, record):
+        line = super().format(record)
+        if record.log_context:
+            line += " [" + " ".join(f"{k}={v}" for k, v in record.log_context.items()) + "]"
+        return line
+
+
+class QueueingHandler(logging.Handler):
+    """Non-blocking handler for the event loop thread.
+
+    Запись не форматируется здесь - только сохраняется контекст и запись
+    кладётся в очередь. Записи ниже WARNING от шумных логгеров
+    прореживаются; при переполнении очереди записи отбрасываются
+    и подсчитываются, а не блокируют обработчики.
+    """
+
+    def __init__(self, log_queue, sampling=None):
+        super().__init__()
+        self.queue = log_queue
+        self.sampling = sampling or {}
+        self.dropped = 0
+        self._rates = {}
+
+    def _rate(self, name):
+        rate = self._rates.get(name)
+        if rate is None:
+            # Ближайший настроенный предок: "httpx" действует и на "httpx._client"
+            rate = 1.0
+            parts = name.split(".")
+            for i in range(len(parts), 0, -1):
+                prefix = ".".join(parts[:i])
+                if prefix in self.sampling:
+                    rate = self.sampling[prefix]
+                    break
+            self._rates[name] = rate
+        return rate
+
+    def emit(self, record):
+        if record.levelno < logging.WARNING:
+            rate = self._rate(record.name)
+            if rate < 1.0 and random.random() >= rate:
+                return
+        record.log_context = log_context.get()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    # Вся работа в emit без блокировок - lock обработчика не нужен
+    def handle(self, record):
+        if self.filter(record):
+            self.emit(record)
+        return record
+
+
+class LogWriter(threading.Thread):
+    """Background thread that formats queued records and writes them in batches."""
+
+    def __init__(self, log_queue, formatter, stream, handler=None):
+        super().__init__(name="log-writer", daemon=True)
+        self.queue = log_queue
+        self.formatter = formatter
+        self.stream = stream
+        self.handler = handler
+        self._reported_dropped = 0
+
+    def run(self):
+        while True:
+            record = self.queue.get()
+            batch = [record]
+            while len(batch) < BATCH_SIZE:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = _STOP in batch
+            self._write([r for r in batch if r is not _STOP])
+            if stop:
+                return
+
+    def _write(self, records):
+        lines = []
+        for record in records:
+            try:
+                lines.append(self.formatter.format(record))
+            except Exception as e:
+                lines.append(f"Ошибка форматирования записи лога {record.name}: {e}")
+        dropped = self.handler.dropped if self.handler else 0
+        if dropped > self._reported_dropped:
+            lines.append(self.formatter.format(logging.makeLogRecord({
+                "name": __name__, "levelno": logging.WARNING, "levelname": "WARNING",
+                "msg": f"Очередь логов переполнена, отброшено записей: {dropped - self._reported_dropped}",
+                "created": time.time(), "log_context": None,
+            })))
+            self._reported_dropped = dropped
+        if not lines:
+            return
+        try:
+            self.stream.write("\n".join(lines) + "\n")
+            self.stream.flush()
+        except Exception:
+            pass
+
+    def stop(self):
+        self.queue.put(_STOP)
+        self.join(timeout=5)
+
+
+def setup(level=logging.INFO, fmt="json", queue_size=10000, sampling=None, stream=None):
+    """Route all logging through a queue to a background writer thread.
+
+    Заменяет обработчики корневого логгера. Возвращает поток записи;
+    при выходе из процесса очередь дописывается до конца.
+    """
+    log_queue = queue.Queue(maxsize=queue_size)
+    handler = QueueingHandler(log_queue, sampling)
+    formatter = JsonFormatter() if fmt == "json" else TextFormatter()
+    writer = LogWriter(log_queue, formatter, stream or sys.stdout, handler)
+    writer.start()
+    atexit.register(writer.stop)
+
+    root = logging.getLogger()
+    for old in root.handlers[:]:
+        root.removeHandler(old)
+    root.addHandler(handler)
+    root.setLevel(level)
+    return writer
@@ -0,0 +1,151 @@
+import io
+import os
+import re
+import shutil
+import logging
+import tempfile
+import subprocess
+from lazy_imports import load
+
+logger = logging.getLogger(__name__)
+
+
+def ffmpeg_binary():
+    """ffmpeg used by moviepy (system one or bundled with imageio-ffmpeg)."""
+    return load("moviepy.config").get_setting("FFMPEG_BINARY")
+
+
+def probe_video(path):
+    """Return moviepy's ffmpeg info dict (duration, audio_found, ...) without decoding frames."""
+    ffmpeg_reader = load("moviepy.video.io.ffmpeg_reader")
+    return ffmpeg_reader.ffmpeg_parse_infos(path)
+
+
+def parse_ranges(text, duration):
+    """Parse "0-10, 15.5-20" into [(0.0, 10.0), (15.5, 20.0)].
+
+    Raises ValueError with a user-facing message on bad input.
+    """
+    ranges = []
+    for part in re.split(r'[,;\n]+', text):
+        part = part.strip()
+        if not part:
+            continue
+        match = re.fullmatch(r'(\d+(?:\.\d+)?)\s*-\s*(\d+(?:\.\d+)?)', part)
+        if not match:
+            raise ValueError(f"Не удалось разобрать фрагмент '{part}'.")
+        start, end = (float(x) for x in match.groups())
+        if start < 0 or end <= start or end > duration:
+            raise ValueError(f"Фрагмент '{part}' должен быть в пределах от 0 до {int(duration)} секунд.")
+        ranges.append((start, end))
+    if not ranges:
+        raise ValueError("Не указано ни одного фрагмента.")
+    return ranges
+
+
+def _segment_filters(ranges, has_audio):
+    """Filter graph that decodes the input once and trims it into len(ranges) streams."""
+    count = len(ranges)
+    graph = [f"[0:v]split={count}" + "".join(f"[v{i}]" for i in range(count))]
+    if has_audio:
+        graph.append(f"[0:a]asplit={count}" + "".join(f"[a{i}]" for i in range(count)))
+    for i, (start, end) in enumerate(ranges):
+        graph.append(f"[v{i}]trim=start={start}:end={end},setpts=PTS-STARTPTS[sv{i}]")
+        if has_audio:
+            graph.append(f"[a{i}]atrim=start={start}:end={end},asetpts=PTS-STARTPTS[sa{i}]")
+    return graph
+
+
+def _run_ffmpeg(args, loglevel="error"):
+    command = [ffmpeg_binary(), "-hide_banner", "-loglevel", loglevel, "-y"] + args
+    result = subprocess.run(command, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg завершился с ошибкой: {result.stderr.strip()[-500:]}")
+    return result.stderr
+
+
+def _input_args(source_path, ranges):
+    # Дальше последнего фрагмента исходник не читаем
+    return ["-to", str(max(end for _, end in ranges)), "-i", source_path]
+
+
+ENCODE_ARGS = ["-c:v", "libx264", "-preset", "veryfast", "-pix_fmt", "yuv420p", "-c:a", "aac", "-movflags", "+faststart"]
+
+
+def cut_segments(source_path, ranges, output_paths):
+    """Write every range to its own file in one ffmpeg run (blocking).
+
+    Исходник декодируется один раз, кадры раздаются фильтром split,
+    все выходные файлы кодируются параллельно.
+    """
+    has_audio = probe_video(source_path).get('audio_found', False)
+    args = _input_args(source_path, ranges)
+    args += ["-filter_complex", ";".join(_segment_filters(ranges, has_audio))]
+    for i, output_path in enumerate(output_paths):
+        args += ["-map", f"[sv{i}]"]
+        if has_audio:
+            args += ["-map", f"[sa{i}]"]
+        args += ENCODE_ARGS + [output_path]
+    _run_ffmpeg(args)
+
+
+def cut_and_concat(source_path, ranges, output_path):
+    """Cut the ranges and join them into one video in one ffmpeg run (blocking)."""
+    has_audio = probe_video(source_path).get('audio_found', False)
+    graph = _segment_filters(ranges, has_audio)
+    inputs = "".join(f"[sv{i}][sa{i}]" if has_audio else f"[sv{i}]" for i in range(len(ranges)))
+    graph.append(f"{inputs}concat=n={len(ranges)}:v=1:a={1 if has_audio else 0}[outv]" + ("[outa]" if has_audio else ""))
+    args = _input_args(source_path, ranges)
+    args += ["-filter_complex", ";".join(graph), "-map", "[outv]"]
+    if has_audio:
+        args += ["-map", "[outa]"]
+    args += ENCODE_ARGS + [output_path]
+    _run_ffmpeg(args)
+
+
+def _extract_keyframes(source_path, output_dir, interval, width):
+    """Write keyframes at least `interval` seconds apart as JPEGs; returns their timestamps."""
+    select = f"select='isnan(prev_selected_t)+gte(t-prev_selected_t,{interval:.3f})'"
+    # -skip_frame nokey: декодер пропускает всё, кроме ключевых кадров
+    stderr = _run_ffmpeg([
+        "-skip_frame", "nokey", "-i", source_path,
+        "-an", "-vf", f"{select},scale={width}:-2,showinfo", "-vsync", "vfr",
+        "-q:v", "5", os.path.join(output_dir, "frame_%03d.jpg"),
+    ], loglevel="info")
+    # Время каждого сохранённого кадра берём из вывода фильтра showinfo
+    return [float(t) for t in re.findall(r"Parsed_showinfo.*?pts_time:\s*([\d.]+)", stderr)]
+
+
+def keyframe_sprite(source_path, max_frames=16, width=240, columns=4):
+    """JPEG bytes of a grid of keyframe thumbnails labelled with their time in seconds (blocking).
+
+    Кадры берутся только ключевые, поэтому видео целиком не декодируется.
+    Возвращает None, если не удалось получить ни одного кадра.
+    """
+    Image = load("PIL.Image")
+    ImageDraw = load("PIL.ImageDraw")
+    duration = probe_video(source_path).get('duration') or 0
+    tmp_dir = tempfile.mkdtemp(prefix="sprite_")
+    try:
+        times = _extract_keyframes(source_path, tmp_dir, duration / max_frames, width)
+        names = sorted(os.listdir(tmp_dir))[:max_frames]
+        if not names:
+            return None
+        frames = [Image.open(os.path.join(tmp_dir, name)).convert("RGB") for name in names]
+        columns = min(columns, len(frames))
+        rows = -(-len(frames) // columns)
+        tile_w, tile_h = frames[0].size
+        sprite = Image.new("RGB", (tile_w * columns, tile_h * rows), "black")
+        draw = ImageDraw.Draw(sprite)
+        for i, frame in enumerate(frames):
+            x, y = (i % columns) * tile_w, (i // columns) * tile_h
+            sprite.paste(frame.resize((tile_w, tile_h)), (x, y))
+            # Встроенный шрифт PIL без кириллицы - подписываем только числом секунд
+            label = f"{times[i]:.1f}" if i < len(times) else "?"
+            draw.rectangle((x, y + tile_h - 16, x + 7 * len(label) + 6, y + tile_h), fill="black")
+            draw.text((x + 3, y + tile_h - 14), label, fill="white")
+        buffer = io.BytesIO()
+        sprite.save(buffer, format="JPEG", quality=80)
+        return buffer.getvalue()
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
@@ -0,0 +1,180 @@
+import sys
+import time
+import asyncio
+import inspect
+import logging
+import threading
+import traceback
+from collections import Counter
+from datetime import datetime
+import os
+
+logger = logging.getLogger(__name__)
+
+# Каталог с исходниками бота - по нему определяем "свои" кадры стека
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Флаги кода корутин и асинхронных генераторов
+_ASYNC_FLAGS = inspect.CO_COROUTINE | inspect.CO_ASYNC_GENERATOR
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+
+
+def _collapse_stack(frame):
+    """Возвращает стек в формате flamegraph: внешний;...;внутренний."""
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    return ";".join(reversed(labels))
+
+
+def _find_handler(frame):
+    """Ищет самую внутреннюю корутину из исходников бота - это и есть обработчик.
+
+    Внешние кадры бота - это main() и run_worker(), а синхронные функции
+    вызываются из обработчика, поэтому берём ближайший кадр-корутину.
+    """
+    while frame is not None:
+        code = frame.f_code
+        if (code.co_flags & _ASYNC_FLAGS and code.co_filename.startswith(SRC_DIR)
+                and code.co_filename != __file__):
+            return code.co_name
+        frame = frame.f_back
+    return None
+
+
+class SamplingProfiler:
+    """Sampling profiler for the event loop thread with a loop-block watchdog.
+
+    A background thread takes a snapshot of every thread's stack each
+    `interval` seconds and aggregates them into collapsed stacks. The same
+    thread checks a heartbeat scheduled on the event loop: if the loop has not
+    ticked for longer than `block_threshold` seconds, the current stack of the
+    loop thread is recorded together with the bot handler that is running.
+    """
+
+    def __init__(self, interval=0.005, block_threshold=0.2):
+        self.interval = interval
+        self.block_threshold = block_threshold
+        self.samples = Counter()
+        self.blocks = []
+        self.sample_count = 0
+        self.updates = 0
+        self.started_at = None
+        self.stopped_at = None
+        self._loop = None
+        self._loop_thread_id = None
+        self._last_beat = 0.0
+        self._stalled = False
+        self._heartbeat_handle = None
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """Start sampling. Must be called from the event loop thread."""
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self.started_at = datetime.now()
+        self._stop_event.clear()
+        self._heartbeat()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self._thread.start()
+        logger.info("Профилировщик запущен (интервал %.1f мс, порог блокировки %.0f мс)",
+                    self.interval * 1000, self.block_threshold * 1000)
+
+    def stop(self):
+        """Stop sampling and wait for the sampler thread to finish."""
+        self._stop_event.set()
+        if self._heartbeat_handle is not None:
+            self._heartbeat_handle.cancel()
+            self._heartbeat_handle = None
+        if self._thread is not None:
+            self._thread.join()
+        self.stopped_at = datetime.now()
+        logger.info("Профилировщик остановлен, собрано сэмплов: %s", self.sample_count)
+
+    def _heartbeat(self):
+        self._last_beat = time.monotonic()
+        if not self._stop_event.is_set():
+            self._heartbeat_handle = self._loop.call_later(self.block_threshold / 4, self._heartbeat)
+
+    def _run(self):
+        own_id = threading.get_ident()
+        names = {}
+        while not self._stop_event.wait(self.interval):
+            frames = sys._current_frames()
+            for thread in threading.enumerate():
+                names[thread.ident] = thread.name
+            for thread_id, frame in frames.items():
+                if thread_id == own_id:
+                    continue
+                thread_name = "event-loop" if thread_id == self._loop_thread_id else names.get(thread_id, str(thread_id))
+                self.samples[f"{thread_name};{_collapse_stack(frame)}"] += 1
+            self.sample_count += 1
+            self._check_loop(frames.get(self._loop_thread_id))
+
+    def _check_loop(self, frame):
+        stall = time.monotonic() - self._last_beat
+        if stall < self.block_threshold:
+            self._stalled = False
+            return
+        # Фиксируем только начало каждой блокировки
+        if self._stalled or frame is None:
+            return
+        self._stalled = True
+        handler = _find_handler(frame)
+        stack = "".join(traceback.format_stack(frame))
+        self.blocks.append({
+            'time': datetime.now(),
+            'stall': stall,
+            'handler': handler,
+            'stack': stack,
+        })
+        logger.warning(f"Event loop заблокирован дольше {stall * 1000:.0f} мс в обработчике {handler}")
+
+    def report(self, sections=()):
+        """Build a text report: summary, loop blocks, hot functions and collapsed stacks.
+
+        sections - дополнительные разделы (заголовок, строки) перед collapsed stacks.
+        """
+        lines = [
+            f"Профиль: {self.started_at:%Y-%m-%d %H:%M:%S} - {self.stopped_at:%Y-%m-%d %H:%M:%S}",
+            f"Сэмплов: {self.sample_count}, интервал: {self.interval * 1000:.1f} мс, обновлений: {self.updates}",
+            f"Порог блокировки event loop: {self.block_threshold * 1000:.0f} мс",
+            "",
+            f"=== Блокировки event loop ({len(self.blocks)}) ===",
+        ]
+        for block in self.blocks:
+            lines.append(f"[{block['time']:%H:%M:%S}] >= {block['stall'] * 1000:.0f} мс, обработчик: {block['handler']}")
+            lines.append(block['stack'])
+
+        # Самые "горячие" функции event loop по собственному времени
+        own = Counter()
+        for stack, count in self.samples.items():
+            if stack.startswith("event-loop;"):
+                own[stack.rsplit(";", 1)[-1]] += count
+        lines.append("")
+        lines.append("=== Горячие функции event loop ===")
+        for label, count in own.most_common(30):
+            share = 100.0 * count / max(self.sample_count, 1)
+            lines.append(f"{share:6.2f}%  {count:6d}  {label}")
+
+        for title, section_lines in sections:
+            lines.append("")
+            lines.append(f"=== {title} ===")
+            lines.extend(section_lines)
+
+        lines.append("")
+        lines.append("=== Collapsed stacks (flamegraph.pl) ===")
+        for stack, count in self.samples.most_common():
+            lines.append(f"{stack} {count}")
+        return "\n".join(lines)
@@ -0,0 +1,221 @@
+import time
+import asyncio
+import logging
+from collections import deque
+from contextlib import asynccontextmanager
+
+logger = logging.getLogger(__name__)
+
+
+class ByteBucket:
+    """Token bucket in bytes with debt.
+
+    charge() списывает байты даже в минус, wait_ready() ждёт, пока долг
+    не восстановится. Так можно учитывать загрузки, размер которых заранее
+    неизвестен: они "оплачиваются" задержкой следующей операции.
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def charge(self, nbytes):
+        self._refill()
+        self.tokens -= nbytes
+
+    async def wait_ready(self):
+        self._refill()
+        while self.tokens < 0:
+            await asyncio.sleep(-self.tokens / self.rate)
+            self._refill()
+
+
+class _Waiter:
+    __slots__ = ("user_id", "future", "on_position", "position")
+
+    def __init__(self, user_id, future, on_position):
+        self.user_id = user_id
+        self.future = future
+        self.on_position = on_position
+        self.position = None
+
+
+class FairScheduler:
+    """Per-user weighted round-robin admission for heavy operations.
+
+    Одновременно выполняется не больше max_concurrent операций и не больше
+    per_user_concurrent у одного пользователя. Ожидающие обслуживаются по
+    кругу между пользователями: пользователь с весом w получает до w слотов
+    за круг. Опционально действует квота скорости в байтах на пользователя.
+    """
+
+    def __init__(self, max_concurrent=2, per_user_concurrent=1, byte_rate=0, weights=None):
+        self.max_concurrent = max_concurrent
+        self.per_user_concurrent = per_user_concurrent
+        self.byte_rate = byte_rate
+        self.weights = weights or {}
+        self.running = 0
+        self._running_by_user = {}
+        self._queues = {}
+        self._order = deque()
+        self._credits = {}
+        self._buckets = {}
+
+    def weight(self, user_id):
+        return max(1, self.weights.get(user_id, 1))
+
+    @property
+    def queued(self):
+        return sum(len(q) for q in self._queues.values())
+
+    def _bucket(self, user_id):
+        if not self.byte_rate:
+            return None
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            # Запас на старте - 10 секунд квоты
+            bucket = self._buckets[user_id] = ByteBucket(self.byte_rate, self.byte_rate * 10)
+        return bucket
+
+    def charge(self, user_id, nbytes):
+        """Account bytes transferred for a user against the byte-rate quota."""
+        bucket = self._bucket(user_id)
+        if bucket is not None:
+            bucket.charge(nbytes)
+
+    async def throttle(self, user_id, nbytes):
+        """Wait for the user's byte quota, then charge `nbytes`."""
+        bucket = self._bucket(user_id)
+        if bucket is not None:
+            await bucket.wait_ready()
+            bucket.charge(nbytes)
+
+    def _can_run(self, user_id):
+        return self._running_by_user.get(user_id, 0) < self.per_user_concurrent
+
+    async def acquire(self, user_id, on_position=None):
+        """Wait for a slot. on_position(n) is awaited whenever the queue position changes."""
+        bucket = self._bucket(user_id)
+        if bucket is not None:
+            await bucket.wait_ready()
+
+        if self.running < self.max_concurrent and self._can_run(user_id) and not self._queues:
+            self._grant(user_id)
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        waiter = _Waiter(user_id, future, on_position)
+        if user_id not in self._queues:
+            self._queues[user_id] = deque()
+            self._order.append(user_id)
+        self._queues[user_id].append(waiter)
+        self._dispatch()
+        self._notify_positions()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Слот уже выдан - возвращаем его
+                self.release(user_id)
+            else:
+                self._remove(waiter)
+                self._notify_positions()
+            raise
+
+    def release(self, user_id):
+        self.running -= 1
+        self._running_by_user[user_id] -= 1
+        if not self._running_by_user[user_id]:
+            del self._running_by_user[user_id]
+        self._dispatch()
+        self._notify_positions()
+
+    @asynccontextmanager
+    async def slot(self, user_id, on_position=None):
+        await self.acquire(user_id, on_position)
+        try:
+            yield
+        finally:
+            self.release(user_id)
+
+    def _grant(self, user_id):
+        self.running += 1
+        self._running_by_user[user_id] = self._running_by_user.get(user_id, 0) + 1
+
+    def _remove(self, waiter):
+        queue = self._queues.get(waiter.user_id)
+        if queue and waiter in queue:
+            queue.remove(waiter)
+            if not queue:
+                del self._queues[waiter.user_id]
+                self._order.remove(waiter.user_id)
+                self._credits.pop(waiter.user_id, None)
+
+    def _dispatch(self):
+        """Grant free slots to waiting users in weighted round-robin order."""
+        skipped = 0
+        while self.running < self.max_concurrent and self._order and skipped < len(self._order):
+            user_id = self._order[0]
+            if not self._can_run(user_id):
+                self._order.rotate(-1)
+                skipped += 1
+                continue
+            skipped = 0
+            waiter = self._queues[user_id].popleft()
+            self._grant(user_id)
+            waiter.future.set_result(None)
+
+            credits = self._credits.get(user_id, self.weight(user_id)) - 1
+            if not self._queues[user_id]:
+                del self._queues[user_id]
+                self._order.popleft()
+                self._credits.pop(user_id, None)
+            elif credits <= 0:
+                # Вес исчерпан - переходим к следующему пользователю
+                self._order.rotate(-1)
+                self._credits.pop(user_id, None)
+            else:
+                self._credits[user_id] = credits
+
+    def _positions(self):
+        """Simulate the round-robin order: {waiter: 1-based position}."""
+        queues = {user_id: list(queue) for user_id, queue in self._queues.items()}
+        order = list(self._order)
+        positions = {}
+        position = 0
+        first = True
+        while order:
+            next_order = []
+            for user_id in order:
+                credits = self._credits.get(user_id, self.weight(user_id)) if first else self.weight(user_id)
+                first = False
+                queue = queues[user_id]
+                for _ in range(min(credits, len(queue))):
+                    position += 1
+                    positions[queue.pop(0)] = position
+                if queue:
+                    next_order.append(user_id)
+            order = next_order
+        return positions
+
+    def _notify_positions(self):
+        if not self._queues:
+            return
+        for waiter, position in self._positions().items():
+            if waiter.on_position is not None and waiter.position != position:
+                waiter.position = position
+                asyncio.get_running_loop().create_task(self._call_on_position(waiter, position))
+
+    @staticmethod
+    async def _call_on_position(waiter, position):
+        try:
+            await waiter.on_position(position)
+        except Exception as e:
+            logger.error(f"Ошибка при обновлении позиции в очереди: {e}")
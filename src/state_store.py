@@ -0,0 +1,251 @@
+import json
+import time
+import sqlite3
+import logging
+import threading
+from collections.abc import MutableMapping
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS kv (
+    namespace TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    PRIMARY KEY (namespace, key)
+);
+CREATE TABLE IF NOT EXISTS updates (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    shard INTEGER NOT NULL,
+    payload TEXT NOT NULL,
+    created REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS updates_shard ON updates (shard, id);
+CREATE TABLE IF NOT EXISTS leases (
+    name TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    expires REAL NOT NULL
+);
+"""
+
+
+class StateStore:
+    """State shared between the front process and workers, in SQLite (WAL mode).
+
+    Все методы блокирующие: из event loop их нужно вызывать через
+    storage.run(), кроме точечных чтений по ключу в SharedDict.
+    У каждого потока своё соединение.
+    """
+
+    def __init__(self, path, busy_timeout=5.0):
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(_SCHEMA)
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # isolation_level=None - автокоммит, транзакции открываем явно
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    # --- ключ-значение ---
+
+    def get(self, namespace, key):
+        row = self._conn().execute(
+            "SELECT value FROM kv WHERE namespace = ? AND key = ?", (namespace, key)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, namespace, key, value):
+        self.set_json(namespace, key, json.dumps(value, ensure_ascii=False))
+
+    def set_json(self, namespace, key, data):
+        """Store an already serialized JSON value."""
+        self._conn().execute(
+            "INSERT OR REPLACE INTO kv (namespace, key, value) VALUES (?, ?, ?)", (namespace, key, data)
+        )
+
+    def set_many(self, namespace, values):
+        conn = self._conn()
+        with conn:
+            conn.execute("BEGIN")
+            conn.executemany(
+                "INSERT OR REPLACE INTO kv (namespace, key, value) VALUES (?, ?, ?)",
+                [(namespace, key, json.dumps(value, ensure_ascii=False)) for key, value in values.items()],
+            )
+
+    def update_many(self, namespace, changes):
+        """Merge {key: {field: value}} into stored dict values in one transaction.
+
+        Чтение и запись идут под одной блокировкой, поэтому изменения разных
+        полей одной записи из разных процессов не затирают друг друга.
+        """
+        conn = self._conn()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            for key, fields in changes.items():
+                row = conn.execute(
+                    "SELECT value FROM kv WHERE namespace = ? AND key = ?", (namespace, key)
+                ).fetchone()
+                value = json.loads(row[0]) if row else {}
+                value.update(fields)
+                conn.execute(
+                    "INSERT OR REPLACE INTO kv (namespace, key, value) VALUES (?, ?, ?)",
+                    (namespace, key, json.dumps(value, ensure_ascii=False)),
+                )
+
+    def delete(self, namespace, key):
+        return self._conn().execute(
+            "DELETE FROM kv WHERE namespace = ? AND key = ?", (namespace, key)
+        ).rowcount > 0
+
+    def delete_many(self, namespace, keys):
+        conn = self._conn()
+        with conn:
+            conn.execute("BEGIN")
+            conn.executemany("DELETE FROM kv WHERE namespace = ? AND key = ?", [(namespace, key) for key in keys])
+
+    def keys(self, namespace):
+        return [row[0] for row in self._conn().execute("SELECT key FROM kv WHERE namespace = ?", (namespace,))]
+
+    def items(self, namespace):
+        return [
+            (key, json.loads(value))
+            for key, value in self._conn().execute("SELECT key, value FROM kv WHERE namespace = ?", (namespace,))
+        ]
+
+    # --- очередь обновлений для воркеров ---
+
+    def push_update(self, shard, payload):
+        self._conn().execute(
+            "INSERT INTO updates (shard, payload, created) VALUES (?, ?, ?)", (shard, payload, time.time())
+        )
+
+    def pop_updates(self, shard, limit=100):
+        """Take up to `limit` queued updates of a shard, oldest first."""
+        conn = self._conn()
+        with conn:
+            # IMMEDIATE - сразу берём блокировку на запись, чтобы две выборки не пересеклись
+            conn.execute("BEGIN IMMEDIATE")
+            rows = conn.execute(
+                "SELECT id, payload FROM updates WHERE shard = ? ORDER BY id LIMIT ?", (shard, limit)
+            ).fetchall()
+            if rows:
+                conn.execute("DELETE FROM updates WHERE shard = ? AND id <= ?", (shard, rows[-1][0]))
+        return [payload for _, payload in rows]
+
+    def queue_lengths(self):
+        return dict(self._conn().execute("SELECT shard, COUNT(*) FROM updates GROUP BY shard"))
+
+    # --- аренды (межпроцессные блокировки с таймаутом) ---
+
+    def acquire_lease(self, name, owner, ttl):
+        """Take a named lease for `ttl` seconds unless another live owner holds it."""
+        conn = self._conn()
+        now = time.time()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT owner, expires FROM leases WHERE name = ?", (name,)).fetchone()
+            if row and row[0] != owner and row[1] > now:
+                return False
+            conn.execute(
+                "INSERT OR REPLACE INTO leases (name, owner, expires) VALUES (?, ?, ?)", (name, owner, now + ttl)
+            )
+        return True
+
+    def release_lease(self, name, owner):
+        self._conn().execute("DELETE FROM leases WHERE name = ? AND owner = ?", (name, owner))
+
+
+# Отметка удалённого ключа, запись которого ещё не дошла до базы
+_DELETED = object()
+
+
+class SharedDict(MutableMapping):
+    """Dict-like view of one StateStore namespace with JSON values.
+
+    Значения возвращаются копиями: после изменения вложенного словаря его
+    нужно записать обратно (d[key] = value). Чтение по первичному ключу
+    в WAL-режиме не ждёт писателей, поэтому выполняется прямо в event loop.
+    Запись же может ждать блокировку другого процесса до busy_timeout,
+    поэтому она уходит в отдельный поток в порядке вызовов, а до её
+    завершения чтения в этом процессе видят значение из очереди записи.
+    """
+
+    def __init__(self, store, namespace):
+        self.store = store
+        self.namespace = namespace
+        # {ключ в базе: JSON-строка или _DELETED} - ещё не записанные изменения
+        self._pending = {}
+        self._lock = threading.Lock()
+        # Один поток - записи выполняются в том же порядке, что и вызовы
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"state-{namespace}")
+
+    def _submit(self, key, data):
+        with self._lock:
+            self._pending[key] = data
+        self._writer.submit(self._flush, key, data)
+
+    def _flush(self, key, data):
+        try:
+            if data is _DELETED:
+                self.store.delete(self.namespace, key)
+            else:
+                self.store.set_json(self.namespace, key, data)
+        except Exception as e:
+            logger.error(f"Не удалось записать {self.namespace}/{key}: {e}")
+        finally:
+            with self._lock:
+                # Более новое изменение того же ключа остаётся в очереди
+                if self._pending.get(key) is data:
+                    del self._pending[key]
+
+    def _get(self, key):
+        with self._lock:
+            data = self._pending.get(key)
+        if data is _DELETED:
+            return None
+        if data is not None:
+            return json.loads(data)
+        return self.store.get(self.namespace, key)
+
+    def __getitem__(self, key):
+        value = self._get(json.dumps(key))
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self._submit(json.dumps(key), json.dumps(value, ensure_ascii=False))
+
+    def __delitem__(self, key):
+        db_key = json.dumps(key)
+        if self._get(db_key) is None:
+            raise KeyError(key)
+        self._submit(db_key, _DELETED)
+
+    def __contains__(self, key):
+        return self._get(json.dumps(key)) is not None
+
+    def _keys(self):
+        keys = set(self.store.keys(self.namespace))
+        with self._lock:
+            for key, data in self._pending.items():
+                if data is _DELETED:
+                    keys.discard(key)
+                else:
+                    keys.add(key)
+        return keys
+
+    def __iter__(self):
+        return iter([json.loads(key) for key in self._keys()])
+
+    def __len__(self):
+        return len(self._keys())
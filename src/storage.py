@@ -0,0 +1,149 @@
+import os
+import shutil
+import asyncio
+import logging
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+import config
+
+logger = logging.getLogger(__name__)
+
+# Расширения, которые считаются видео
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mov')
+
+# Отдельный пул для файловых операций, чтобы медленный диск не блокировал event loop
+# и не занимал общий executor по умолчанию
+_executor = ThreadPoolExecutor(max_workers=config.STORAGE_THREADS, thread_name_prefix="storage")
+
+
+async def run(func, *args, **kwargs):
+    """Run a blocking filesystem call in the storage thread pool."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, partial(func, *args, **kwargs))
+
+
+def _list_folders(root):
+    return [f for f in os.listdir(root) if os.path.isdir(os.path.join(root, f))]
+
+
+def _list_videos(folder_path):
+    return [f for f in os.listdir(folder_path) if f.endswith(VIDEO_EXTENSIONS)]
+
+
+def _folder_video_counts(root):
+    return [(folder, len(_list_videos(os.path.join(root, folder)))) for folder in _list_folders(root)]
+
+
+def _folder_video_sizes(root):
+    result = []
+    for folder in _list_folders(root):
+        folder_path = os.path.join(root, folder)
+        files = [(f, os.path.getsize(os.path.join(folder_path, f))) for f in _list_videos(folder_path)]
+        result.append((folder, files))
+    return result
+
+
+async def listdir(path):
+    return await run(os.listdir, path)
+
+
+async def list_folders(root=None):
+    """Names of the folders in the resources directory."""
+    return await run(_list_folders, root or config.RESOURCES_DIR)
+
+
+async def list_videos(folder_path):
+    """Names of the video files in a folder."""
+    return await run(_list_videos, folder_path)
+
+
+async def folder_video_counts(root=None):
+    """[(folder, number of videos)] in a single thread hop."""
+    return await run(_folder_video_counts, root or config.RESOURCES_DIR)
+
+
+async def folder_video_sizes(root=None):
+    """[(folder, [(file, size in bytes)])] in a single thread hop."""
+    return await run(_folder_video_sizes, root or config.RESOURCES_DIR)
+
+
+async def makedirs(path):
+    await run(os.makedirs, path, exist_ok=True)
+
+
+async def rename(src, dst):
+    await run(os.rename, src, dst)
+
+
+async def remove(path):
+    await run(os.remove, path)
+
+
+async def remove_if_exists(path):
+    def _remove(path):
+        if os.path.exists(path):
+            os.remove(path)
+    await run(_remove, path)
+
+
+def _link_or_copy(src, dst):
+    try:
+        os.link(src, dst)
+    except OSError:
+        # Другая файловая система или ссылки не поддерживаются
+        shutil.copyfile(src, dst)
+
+
+async def link_or_copy(src, dst):
+    """Hard-link src to dst where the filesystem allows it, otherwise copy it."""
+    await run(_link_or_copy, src, dst)
+
+
+async def exists(path):
+    return await run(os.path.exists, path)
+
+
+async def getsize(path):
+    return await run(os.path.getsize, path)
+
+
+def _rmtree_counting(path, progress):
+    """shutil.rmtree that reports deleted/total files through the `progress` dict."""
+    files = []
+    dirs = []
+    for root, dirnames, filenames in os.walk(path, topdown=False):
+        files.extend(os.path.join(root, f) for f in filenames)
+        dirs.extend(os.path.join(root, d) for d in dirnames)
+    progress['total'] = len(files)
+    for file_path in files:
+        os.remove(file_path)
+        progress['done'] += 1
+    for dir_path in dirs:
+        os.rmdir(dir_path)
+    # На случай, если что-то появилось во время удаления
+    shutil.rmtree(path, ignore_errors=True)
+    return progress['done']
+
+
+async def rmtree(path, on_progress=None, interval=1.0):
+    """Delete a directory tree in the storage pool.
+
+    on_progress - корутина on_progress(done, total), вызывается не чаще раза
+    в `interval` секунд, пока идёт удаление, и только если число удалённых
+    файлов изменилось. Возвращает число удалённых файлов.
+    """
+    progress = {'done': 0, 'total': 0}
+    reported = 0
+    loop = asyncio.get_running_loop()
+    future = loop.run_in_executor(_executor, _rmtree_counting, path, progress)
+    while True:
+        done, _ = await asyncio.wait({future}, timeout=interval)
+        if done:
+            return future.result()
+        # Тот же текст Telegram отклоняет ("Message is not modified")
+        if on_progress is not None and progress['done'] != reported:
+            reported = progress['done']
+            try:
+                await on_progress(progress['done'], progress['total'])
+            except Exception as e:
+                logger.error(f"Ошибка при обновлении прогресса удаления: {e}")
@@ -0,0 +1,207 @@
+import os
+import re
+import time
+import json
+import uuid
+import struct
+import zlib
+import logging
+import httpx
+import storage
+
+logger = logging.getLogger(__name__)
+
+# Размер блока чтения с диска
+CHUNK_SIZE = 1024 * 1024
+
+# Флаги записи: 3 - CRC и размеры в дескрипторе после данных, 11 - имя в UTF-8
+_FLAGS = 0x0008 | 0x0800
+_VERSION = 20
+_LOCAL_HEADER = struct.Struct("<IHHHHHIIIHH")
+_DATA_DESCRIPTOR = struct.Struct("<IIII")
+_CENTRAL_HEADER = struct.Struct("<IHHHHHHIIIHHHHHII")
+_END_RECORD = struct.Struct("<IHHHHIIH")
+# Без ZIP64 размеры и смещения ограничены 4 ГБ
+_ZIP32_LIMIT = 0xFFFFFFFF
+
+# Символы, которые ломают заголовок Content-Disposition
+_UNSAFE_FILENAME_RE = re.compile(r'["\\\r\n]')
+
+
+class ZipEntry:
+    __slots__ = ("name", "path", "size", "mtime", "crc", "offset")
+
+    def __init__(self, name, path, size, mtime):
+        self.name = name
+        self.path = path
+        self.size = size
+        self.mtime = mtime
+        self.crc = 0
+        self.offset = 0
+
+    @property
+    def encoded_name(self):
+        return self.name.encode("utf-8")
+
+
+def _dos_datetime(timestamp):
+    t = time.localtime(timestamp)
+    year = max(t.tm_year, 1980)
+    return (
+        (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2),
+        ((year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday,
+    )
+
+
+def entry_size(entry):
+    """Bytes an entry takes in the archive: local header, data, descriptor and central record."""
+    name_len = len(entry.encoded_name)
+    return _LOCAL_HEADER.size + name_len + entry.size + _DATA_DESCRIPTOR.size + _CENTRAL_HEADER.size + name_len
+
+
+def archive_size(entries):
+    return sum(entry_size(e) for e in entries) + _END_RECORD.size
+
+
+def _scan_folder(folder_path):
+    entries = []
+    for name in sorted(storage._list_videos(folder_path)):
+        path = os.path.join(folder_path, name)
+        st = os.stat(path)
+        entries.append(ZipEntry(name, path, st.st_size, st.st_mtime))
+    return entries
+
+
+def plan_volumes(entries, limit):
+    """Split entries into independent archives of at most `limit` bytes each.
+
+    Возвращает (тома, пропущенные файлы). Файл, который не помещается
+    даже в отдельный том, пропускается.
+    """
+    limit = min(limit, _ZIP32_LIMIT)
+    volumes = []
+    skipped = []
+    current = []
+    current_size = _END_RECORD.size
+    for entry in entries:
+        size = entry_size(entry)
+        if size + _END_RECORD.size > limit:
+            skipped.append(entry)
+            continue
+        if current and current_size + size > limit:
+            volumes.append(current)
+            current = []
+            current_size = _END_RECORD.size
+        current.append(entry)
+        current_size += size
+    if current:
+        volumes.append(current)
+    return volumes, skipped
+
+
+async def plan_folder(folder_path, limit):
+    """plan_volumes() for every video of a folder."""
+    entries = await storage.run(_scan_folder, folder_path)
+    return plan_volumes(entries, limit)
+
+
+def _read_chunk(f, size):
+    return f.read(size)
+
+
+async def stream_volume(entries, chunk_size=CHUNK_SIZE):
+    """Yield a stored (uncompressed) zip archive of the entries chunk by chunk.
+
+    Файлы читаются с диска блоками в пуле storage, CRC считается на лету и
+    записывается в дескриптор после данных, поэтому архив не собирается
+    ни в памяти, ни во временном файле.
+    """
+    offset = 0
+    for entry in entries:
+        name = entry.encoded_name
+        dos_time, dos_date = _dos_datetime(entry.mtime)
+        entry.offset = offset
+        header = _LOCAL_HEADER.pack(
+            0x04034b50, _VERSION, _FLAGS, 0, dos_time, dos_date, 0, 0, 0, len(name), 0
+        ) + name
+        yield header
+        offset += len(header)
+
+        crc = 0
+        written = 0
+        f = await storage.run(open, entry.path, "rb")
+        try:
+            while written < entry.size:
+                chunk = await storage.run(_read_chunk, f, min(chunk_size, entry.size - written))
+                if not chunk:
+                    break
+                crc = zlib.crc32(chunk, crc)
+                written += len(chunk)
+                yield chunk
+        finally:
+            await storage.run(f.close)
+        if written != entry.size:
+            # Размер уже объявлен в Content-Length - продолжать нельзя
+            raise RuntimeError(f"Файл {entry.name} изменился во время экспорта")
+        entry.crc = crc
+        offset += written
+
+        descriptor = _DATA_DESCRIPTOR.pack(0x08074b50, crc, entry.size, entry.size)
+        yield descriptor
+        offset += len(descriptor)
+
+    central_start = offset
+    central = bytearray()
+    for entry in entries:
+        name = entry.encoded_name
+        dos_time, dos_date = _dos_datetime(entry.mtime)
+        central += _CENTRAL_HEADER.pack(
+            0x02014b50, _VERSION, _VERSION, _FLAGS, 0, dos_time, dos_date,
+            entry.crc, entry.size, entry.size, len(name), 0, 0, 0, 0, 0, entry.offset
+        ) + name
+    central += _END_RECORD.pack(
+        0x06054b50, 0, 0, len(entries), len(entries), len(central), central_start, 0
+    )
+    yield bytes(central)
+
+
+async def upload_volume(bot, chat_id, filename, entries, caption=None, reply_to_message_id=None):
+    """Send a volume with sendDocument, streaming the multipart body straight from disk.
+
+    InputFile из python-telegram-bot читает файл в память целиком, поэтому
+    запрос к Bot API собирается здесь вручную. Возвращает file_id документа.
+    """
+    boundary = uuid.uuid4().hex
+    fields = {"chat_id": str(chat_id)}
+    if caption:
+        fields["caption"] = caption
+    if reply_to_message_id:
+        fields["reply_to_message_id"] = str(reply_to_message_id)
+    preamble = b"".join(
+        f'--{boundary}\r\nContent-Disposition: form-data; name="{key}"\r\n\r\n{value}\r\n'.encode("utf-8")
+        for key, value in fields.items()
+    )
+    filename = _UNSAFE_FILENAME_RE.sub("_", filename)
+    preamble += (
+        f'--{boundary}\r\nContent-Disposition: form-data; name="document"; filename="{filename}"\r\n'
+        f'Content-Type: application/zip\r\n\r\n'
+    ).encode("utf-8")
+    epilogue = f"\r\n--{boundary}--\r\n".encode("utf-8")
+
+    async def body():
+        yield preamble
+        async for chunk in stream_volume(entries):
+            yield chunk
+        yield epilogue
+
+    headers = {
+        "Content-Type": f"multipart/form-data; boundary={boundary}",
+        "Content-Length": str(len(preamble) + archive_size(entries) + len(epilogue)),
+    }
+    timeout = httpx.Timeout(30.0, write=None, read=300.0)
+    async with httpx.AsyncClient(timeout=timeout) as client:
+        response = await client.post(f"{bot.base_url}/sendDocument", content=body(), headers=headers)
+    result = json.loads(response.content)
+    if not result.get("ok"):
+        raise RuntimeError(f"Bot API: {result.get('description')}")
+    return result["result"]["document"]["file_id"]